@@ -0,0 +1,79 @@
+'''
+measure the import time of thrift_fmt modules and the `--help` startup time,
+each one in fresh interpreters, and print the result as json.
+
+    python benchmarks/import_time.py [--repeat 5] [--output import_time.json]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES: List[str] = ['thrift_fmt', 'thrift_fmt.main', 'thrift_fmt.core']
+HEAVY_MODULES: List[str] = ['antlr4', 'thrift_parser']
+
+
+def _run(code: str, *args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    return subprocess.run([sys.executable, *args, '-c', code], env=env, cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+                          universal_newlines=True)
+
+
+def import_time_us(module: str) -> int:
+    # the cumulative time reported by `python -X importtime` for the module
+    result = _run('import {}'.format(module), '-X', 'importtime')
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise ValueError('module {} not found in importtime output'.format(module))
+
+
+def wall_time_s(code: str) -> float:
+    start = time.perf_counter()
+    _run(code)
+    return time.perf_counter() - start
+
+
+def loaded_heavy_modules(code: str) -> List[str]:
+    code = code + '\nimport sys\nprint("heavy:" + ",".join(m for m in {!r} if m in sys.modules))'.format(HEAVY_MODULES)
+    output = _run(code).stdout.rsplit('heavy:', 1)[-1].strip()
+    return [m for m in output.split(',') if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the json to this file instead of stdout')
+    args = parser.parse_args()
+
+    result: Dict[str, Dict[str, object]] = {}
+    for module in MODULES:
+        result[module] = {
+            'import_us': statistics.median(import_time_us(module) for _ in range(args.repeat)),
+            'heavy_modules': loaded_heavy_modules('import {}'.format(module)),
+        }
+
+    help_code = 'from thrift_fmt.main import main\nmain(["--help"], standalone_mode=False)'
+    result['--help'] = {
+        'wall_s': statistics.median(wall_time_s(help_code) for _ in range(args.repeat)),
+        'heavy_modules': loaded_heavy_modules(help_code),
+    }
+
+    text = json.dumps({'python': sys.version.split()[0], 'results': result}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+'''
+format synthetic thrift documents at increasing sizes, time the parse, patch,
+alignment and emit phases separately for each option combination, and print
+the result as json. it runs offline, compare the json across releases.
+
+    python benchmarks/scaling.py [--sizes 10,100,1000,10000] [--shapes struct,enum]
+                                 [--repeat 3] [--output scaling.json]
+'''
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from thrift_parser import ThriftData  # noqa: E402
+from thrift_fmt import Option, ThriftFormatter  # noqa: E402
+from thrift_fmt.cache import get_version  # noqa: E402
+from thrift_fmt.core import NodeMeasure  # noqa: E402
+from thrift_fmt.ir import Document  # noqa: E402
+
+TYPES: List[str] = ['i32', 'string', 'list<i64>', 'map<string, double>', 'set<binary>', 'Other']
+OPTION_KEYS: List[str] = ['align_assign', 'align_field', 'keep_comment']
+
+
+def gen_struct(n: int) -> str:
+    # one struct of n fields
+    fields = []
+    for i in range(1, n + 1):
+        default = ' = {}'.format(i) if TYPES[i % len(TYPES)] == 'i32' else ''
+        fields.append('  {}: {} field_{}{},\n'.format(i, TYPES[i % len(TYPES)], i, default))
+    return 'struct Big {\n' + ''.join(fields) + '}\n'
+
+
+def gen_enum(n: int) -> str:
+    # n enums of 8 values
+    return ''.join(
+        'enum E{} {{\n'.format(i) + ''.join('  V{}_{} = {},\n'.format(i, j, j) for j in range(8)) + '}\n\n'
+        for i in range(n))
+
+
+def gen_comment(n: int) -> str:
+    # n fields with leading, multi line and tail comments
+    fields = []
+    for i in range(1, n + 1):
+        fields.append('  // field {}\n  /* about\n     field {} */\n  {}: i32 f{} # tail {}\n'.format(i, i, i, i, i))
+    return '/* comment dense */\n// header\nstruct Commented {\n' + ''.join(fields) + '} // end\n'
+
+
+def gen_nested(n: int) -> str:
+    # n fields of deeply nested container types with nested const values
+    nested = 'map<string, list<set<map<i32, list<string>>>>>'
+    value = '{"k": [[{1: ["a", "b"]}]]}'
+    return 'struct Nested {\n' + ''.join(
+        '  {}: optional {} f{} = {},\n'.format(i, nested, i, value) for i in range(1, n + 1)) + '}\n'
+
+
+SHAPES: Dict[str, Callable[[int], str]] = {
+    'struct': gen_struct,
+    'enum': gen_enum,
+    'comment': gen_comment,
+    'nested': gen_nested,
+}
+
+
+class TimedFormatter(ThriftFormatter):
+    '''
+        measure the time of the alignment computation in the subblocks
+    '''
+
+    def __init__(self, data: Document):
+        super().__init__(data)
+        self.align_s: float = 0.0
+
+    def before_subblocks(self, subblocks):
+        start = time.perf_counter()
+        super().before_subblocks(subblocks)
+        self.align_s += time.perf_counter() - start
+
+
+def measure(source: str, options: List[Option]) -> List[Dict[str, float]]:
+    # the tree is parsed, converted and patched once, the patch does not depend on the options measured
+    start = time.perf_counter()
+    data = Document.from_data(ThriftData.from_str(source))
+    parse_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    root = ThriftFormatter(data)._patch()
+    patch_s = time.perf_counter() - start
+
+    results = []
+    for option in options:
+        start = time.perf_counter()
+        fmt = TimedFormatter(data)
+        fmt.option(option)
+        fmt._measure = NodeMeasure()
+        fmt.format_node(root)
+        format_s = time.perf_counter() - start
+        results.append({
+            'parse_s': parse_s,
+            'patch_s': patch_s,
+            'align_s': fmt.align_s,
+            'emit_s': format_s - fmt.align_s,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='comma separated sizes')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='comma separated shapes')
+    parser.add_argument('--repeat', type=int, default=3, help='the best of the runs is kept')
+    parser.add_argument('--output', help='write the json to this file instead of stdout')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    options = [dict(zip(OPTION_KEYS, values)) for values in itertools.product([True, False], repeat=len(OPTION_KEYS))]
+
+    results = []
+    for shape in args.shapes.split(','):
+        for size in sizes:
+            source = SHAPES[shape](size)
+            runs = [measure(source, [Option(**option) for option in options]) for _ in range(args.repeat)]
+            for i, option in enumerate(options):
+                best = {key: min(run[i][key] for run in runs) for key in runs[0][i]}
+                best['total_s'] = sum(best.values())
+                results.append({'shape': shape, 'size': size, 'bytes': len(source), 'option': option, **best})
+            print('{} {}'.format(shape, size), file=sys.stderr)
+
+    text = json.dumps({
+        'python': sys.version.split()[0],
+        'thrift-fmt': get_version('thrift-fmt', 'thrift_fmt'),
+        'thrift-parser': get_version('thrift-parser', 'thrift_parser'),
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
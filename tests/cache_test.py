@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from click.testing import CliRunner
+
+import thrift_fmt.parser
+from thrift_fmt import Option
+from thrift_fmt import cache as cache_module
+from thrift_fmt.cache import Cache, CACHE_DIR_ENV, get_version
+from thrift_fmt.main import main
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv(CACHE_DIR_ENV, str(cache_dir))
+    return cache_dir
+
+
+def test_cache(cache_dir):
+    cache = Cache(Option())
+    assert not cache.is_formatted('struct A {\n}')
+    cache.add('struct A {\n}')
+    cache.save()
+
+    assert Cache(Option()).is_formatted('struct A {\n}')
+    assert not Cache(Option(indent=2)).is_formatted('struct A {\n}')
+    assert not Cache(Option(), cache_dir=cache_dir / 'other').is_formatted('struct A {\n}')
+
+
+def test_cache_evict(cache_dir):
+    cache = Cache(Option(), max_entries=2)
+    for source in ['a', 'b', 'c']:
+        cache.add(source)
+    cache.is_formatted('a')
+    cache.save()
+
+    cache = Cache(Option(), max_entries=2)
+    assert cache.is_formatted('a')
+    assert not cache.is_formatted('b')
+    assert cache.is_formatted('c')
+
+
+def test_cache_skip_parse(tmp_path, monkeypatch):
+    with open(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')) as f:
+        (tmp_path / 'simple.thrift').write_text(f.read())
+
+    runner = CliRunner()
+    # format, then check the formatted file and remember it
+    assert runner.invoke(main, [str(tmp_path)]).exit_code == 0
+    assert runner.invoke(main, ['--check', str(tmp_path)]).exit_code == 0
+
+    def parse_error(*_):
+        raise AssertionError('should not parse')
+
+    monkeypatch.setattr(thrift_fmt.parser, 'parse', parse_error)
+    result = runner.invoke(main, ['--check', str(tmp_path)])
+    assert result.exit_code == 0
+
+    result = runner.invoke(main, ['--check', '--no-cache', str(tmp_path)])
+    assert result.exit_code == 1
+    assert 'should not parse' in result.output
+
+
+def test_get_version(monkeypatch):
+    assert get_version('thrift-parser') not in ('', 'unknown')
+    assert get_version('not-a-package') == 'unknown'
+
+    # an uninstalled checkout is known by its sources
+    monkeypatch.setattr(cache_module, '_metadata_version', lambda _: None)
+    version = get_version('thrift-fmt', 'thrift_fmt')
+    assert version.startswith('source-')
+    assert version == get_version('thrift-fmt', 'thrift_fmt')
+    assert get_version('thrift-fmt', 'not_a_module') == 'unknown'
@@ -0,0 +1,96 @@
+'''
+format generated documents of size N and 8N, and fail if the time or the peak
+memory grows far faster than linear. the tier is left out of the default run,
+run it by `pytest -m complexity`.
+'''
+import functools
+import gc
+import time
+import tracemalloc
+
+import pytest
+
+from thrift_parser import ThriftData
+from thrift_fmt import Option, ThriftFormatter
+from thrift_fmt.ir import Document
+
+pytestmark = pytest.mark.complexity
+
+N = 200
+SCALE = 8
+# linear is 8, quadratic is 64, allow the noise of the small size
+MAX_TIME_RATIO = 16
+MAX_MEMORY_RATIO = 16
+
+
+def gen_struct(n):
+    return 'struct Long {\n' + ''.join(
+        '  {}: optional list<i32> field_{} = [{}],\n'.format(i, i, i)
+        for i in range(1, n + 1)) + '}\n'
+
+
+def gen_comments(n):
+    return 'struct Commented {\n' + ''.join(
+        '  // about {}\n  /* more\n     about {} */\n  {}: i32 f{}, # tail {}\n'.format(i, i, i, i, i)
+        for i in range(1, n + 1)) + '} // end\n'
+
+
+def gen_enum(n):
+    return 'enum Long {\n' + ''.join('  VALUE_{} = {},\n'.format(i, i) for i in range(n)) + '}\n'
+
+
+def gen_service(n):
+    return 'service Big {\n' + ''.join(
+        '  list<string> call_{}(1: i32 a) throws (1: Error e),\n'.format(i)
+        for i in range(n)) + '}\n'
+
+
+@functools.lru_cache()
+def parse(source):
+    # the format never changes the tree, so it can be shared
+    return Document.from_data(ThriftData.from_str(source))
+
+
+def format_data(data, option):
+    fmt = ThriftFormatter(data)
+    fmt.option(option)
+    return fmt.format()
+
+
+def measure(source, option, repeat=3):
+    data = parse(source)
+
+    # like timeit, the collections of the other live objects are not timed
+    seconds = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            format_data(data, option)
+            seconds.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    try:
+        format_data(data, option)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak
+
+
+@pytest.mark.parametrize('gen, option', [
+    (gen_struct, Option()),
+    (gen_struct, Option(align_field=True)),
+    (gen_comments, Option()),
+    (gen_enum, Option()),
+    (gen_service, Option()),
+], ids=['struct', 'struct-align-field', 'comments', 'enum', 'service'])
+def test_complexity(gen, option):
+    small_time, small_memory = measure(gen(N), option)
+    large_time, large_memory = measure(gen(N * SCALE), option)
+
+    assert large_time / small_time < MAX_TIME_RATIO, (small_time, large_time)
+    assert large_memory / small_memory < MAX_MEMORY_RATIO, (small_memory, large_memory)
@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+from thrift_parser import ThriftData
+from thrift_fmt import ThriftFormatter, Option
+from thrift_fmt.cache import CACHE_DIR_ENV
+from thrift_fmt.daemon import DaemonClient, DaemonError, make_server
+from thrift_fmt.main import main
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='unix socket only')
+
+
+@pytest.fixture
+def socket_path(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    socket_path = str(tmp_path / 'fmt.sock')
+    server = make_server(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+
+
+def test_daemon(socket_path):
+    data = 'struct A {\n1: i32 a = 1 // a\n2: string bb}'
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option(indent=2))
+
+    with DaemonClient(socket_path) as client:
+        assert client.format(data, Option(indent=2)) == fmt.format()
+        # the connection can be reused
+        assert client.format('include  "a.thrift"', Option()) == 'include "a.thrift"'
+
+
+def test_daemon_error(socket_path, tmp_path):
+    with pytest.raises(DaemonError):
+        DaemonClient(str(tmp_path / 'missing.sock'))
+
+    result = CliRunner().invoke(main, ['--daemon-socket', str(tmp_path / 'missing.sock'),
+                                       os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')])
+    assert result.exit_code == 1
+
+
+def test_daemon_click(socket_path):
+    file = os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')
+    local = CliRunner().invoke(main, ['--no-cache', file])
+    remote = CliRunner().invoke(main, ['--no-cache', '--daemon-socket', socket_path, file])
+    assert remote.exit_code == 0
+    assert remote.output == local.output
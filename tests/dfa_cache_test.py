@@ -0,0 +1,55 @@
+import glob
+import os
+import pickle
+
+from antlr4.tree.Trees import Trees
+from thrift_parser.ThriftParser import ThriftParser
+
+import thrift_fmt
+from thrift_fmt import dfa_cache
+from thrift_fmt.parser import parse
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_corpus():
+    data = parse(dfa_cache.CORPUS, strict=True)
+    rules = {type(node).__name__ for node in data.document.getChildren()}
+    assert {'HeaderContext', 'DefinitionContext'} <= rules
+
+
+def test_warmup():
+    thrift_fmt.warmup()
+    assert any(dfa.states for dfa in ThriftParser.decisionsToDFA)
+
+
+def test_state_file(tmp_path):
+    path = str(tmp_path / 'dfa' / 'state.pickle')
+    assert not dfa_cache.load_state(path)
+    thrift_fmt.warmup(path)
+    assert dfa_cache.load_state(path)
+
+    for file in sorted(glob.glob(os.path.join(TEST_DIR, 'fixtures', '*.thrift'))):
+        with open(file, newline='') as f:
+            source = f.read()
+        data = parse(source, regex_lexer=False)
+        expected = parse(source, sll=False)
+        assert Trees.toStringTree(data.document) == Trees.toStringTree(expected.document)
+
+
+def test_state_file_mismatch(tmp_path):
+    path = tmp_path / 'state.pickle'
+    path.write_bytes(b'broken')
+    assert not dfa_cache.load_state(str(path))
+
+    state = dfa_cache._state()
+    state['version'] = '0'
+    path.write_bytes(pickle.dumps(state))
+    assert not dfa_cache.load_state(str(path))
+
+
+def test_state_file_unknown_version(tmp_path, monkeypatch):
+    path = str(tmp_path / 'state.pickle')
+    dfa_cache.save_state(path)
+    monkeypatch.setattr(dfa_cache, 'get_version', lambda *_: 'unknown')
+    assert not dfa_cache.load_state(path)
@@ -1,15 +1,28 @@
+import io
 import os
 import glob
+import json
+import subprocess
+import sys
 
+import pytest
 from click.testing import CliRunner
 from thrift_fmt.main import main
+from thrift_fmt.cache import CACHE_DIR_ENV
 
 from thrift_parser import ThriftData
 from thrift_fmt import PureThriftFormatter, ThriftFormatter, Option
+from thrift_fmt.core import CommentIndex, OutputWriter, NodeMeasure, FormatProfile
+from thrift_fmt.ir import convert_node
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path_factory.mktemp('cache')))
+
+
 def run_fmt(file, patch=True):
     fin = os.path.abspath(os.path.join(TEST_DIR, 'fixtures', file))
     data = ThriftData.from_file(fin)
@@ -413,3 +426,350 @@ def test_with_click():
     for args in args_list:
         result = runner.invoke(main, args)
         assert result.exit_code == 0
+
+
+def test_comment_index():
+    data = '''/* a */
+include "a.thrift" // b
+// c
+struct A {
+}
+'''
+    thrift = ThriftData.from_str(data)
+    index = CommentIndex(thrift.tokens)
+    texts = [token.text.strip() for token in index.between(-1, len(thrift.tokens) - 1)]
+    assert texts == ['/* a */', '// b', '// c']
+
+    include = thrift.document.children[0].children[0].children[1].symbol
+    assert index.tail(include.tokenIndex).text.strip() == '// b'
+    assert [token.text.strip() for token in index.between(include.tokenIndex, len(thrift.tokens))] == ['// b', '// c']
+    assert index.tail(0) is None
+
+
+def test_output_writer():
+    out = OutputWriter()
+    out.push('struct A {')
+    assert out.column == len('struct A {')
+    out.newline()
+    out.newline(2)
+    assert out.column == 0
+    out.push('    1: i32 a,')
+    assert out.column == len('    1: i32 a,')
+    out.append(' // a\nb')
+    assert out.column == 1
+    assert out.getvalue() == 'struct A {\n\n    1: i32 a, // a\nb'
+
+
+def test_node_measure():
+    thrift = ThriftData.from_str('struct A {\n 1: map<string,i32> a = {"a": 1}, // a\n}')
+    # the measure caches the nodes of the compact tree
+    field = convert_node(thrift.document.children[0].children[0].children[3])
+    measure = NodeMeasure()
+    assert measure.text(field) == PureThriftFormatter().format_node(field)
+    assert measure.width(field) == len('1: map<string, i32> a = { "a" : 1 },')
+    for child in field.children:
+        assert measure.get(child) == PureThriftFormatter().format_node(child)
+
+
+def test_patch_function_separator():
+    data = '''service S {
+void ping(1: i32 a; 2: i32 b) throws (1: E e 2: F f)
+oneway void pong(1: string s (x = "y", z = "w"))
+}'''
+    thrift = ThriftData.from_str(data)
+    fmt = ThriftFormatter(thrift)
+    fmt.option(Option())
+    out = fmt.format()
+    assert out == '''service S {
+    void ping(1: i32 a, 2: i32 b) throws(1: E e, 2: F f),
+    oneway void pong(1: string s (x = "y", z = "w")),
+}'''
+
+
+def test_patch_keep_tree():
+    data = 'struct A {\n1: i32 a; 2: i32 b (x = "y"; z = "w")\n}\nservice S {\nvoid ping(1: i32 a; 2: i32 b)\n}'
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    document = fmt._document
+    before = PureThriftFormatter().format_node(document)
+
+    fmt.option(Option())
+    patched = fmt.format()
+    assert 'required' in patched
+    assert PureThriftFormatter().format_node(document) == before
+
+    # the same formatter under other options, without parsing again
+    for option in [Option().disble_patch(), Option(keep_comment=False), Option()]:
+        fmt.option(option)
+        expected = ThriftFormatter(ThriftData.from_str(data))
+        expected.option(option)
+        assert fmt.format() == expected.format()
+    assert fmt.format() == patched
+
+
+def test_subclass_handler():
+    class UpperIncludeFormatter(PureThriftFormatter):
+        def Include_Context(self, node):
+            self._push('INCLUDE ' + node.children[1].symbol.text)
+
+    thrift = ThriftData.from_str('include "a.thrift"\ninclude "b.thrift"')
+    assert UpperIncludeFormatter().format_node(thrift.document) == 'INCLUDE "a.thrift"\nINCLUDE "b.thrift"'
+    assert PureThriftFormatter().format_node(thrift.document) == 'include "a.thrift"\ninclude "b.thrift"'
+
+
+def test_with_click_jobs(tmp_path):
+    for name in ['simple.thrift', 'tutorial.thrift', 'shared.thrift']:
+        with open(os.path.join(TEST_DIR, 'fixtures', name)) as f:
+            (tmp_path / name).write_text(f.read())
+    (tmp_path / 'broken.thrift').write_bytes(b'struct \xff {}')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-j', '2', str(tmp_path)])
+    assert result.exit_code == 1
+    assert 'broken.thrift' in result.output
+    fmt = ThriftFormatter(ThriftData.from_file(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')))
+    assert (tmp_path / 'simple.thrift').read_text() == fmt.format()
+
+    result = runner.invoke(main, ['-j', '2', str(tmp_path / 'simple.thrift')])
+    assert result.exit_code == 0
+
+
+def test_with_click_check(tmp_path):
+    with open(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')) as f:
+        (tmp_path / 'simple.thrift').write_text(f.read())
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['--check', str(tmp_path)])
+    assert result.exit_code == 1
+    assert 'would reformat' in result.output
+
+    result = runner.invoke(main, [str(tmp_path)])
+    assert result.exit_code == 0
+    mtime = os.stat(tmp_path / 'simple.thrift').st_mtime_ns
+
+    result = runner.invoke(main, ['--check', str(tmp_path)])
+    assert result.exit_code == 0
+    result = runner.invoke(main, ['-w', str(tmp_path / 'simple.thrift')])
+    assert result.exit_code == 0
+    assert os.stat(tmp_path / 'simple.thrift').st_mtime_ns == mtime
+
+
+def test_iter_format():
+    fin = os.path.join(TEST_DIR, 'fixtures', 'ThriftTest.thrift')
+    expected = ThriftFormatter(ThriftData.from_file(fin)).format()
+
+    fmt = ThriftFormatter(ThriftData.from_file(fin))
+    texts = list(fmt.iter_format())
+    assert len(texts) > 10
+    assert ''.join(texts) == expected
+
+    out = io.StringIO()
+    fmt.format_to(out)
+    assert out.getvalue() == expected
+
+
+def test_with_click_stream(tmp_path):
+    with open(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')) as f:
+        (tmp_path / 'simple.thrift').write_text(f.read())
+    os.chmod(tmp_path / 'simple.thrift', 0o640)
+    fmt = ThriftFormatter(ThriftData.from_file(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')))
+    expected = fmt.format()
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-j', '1', str(tmp_path / 'simple.thrift')])
+    assert result.exit_code == 0
+    assert result.output == expected + '\n'
+
+    result = runner.invoke(main, ['-j', '1', '-w', str(tmp_path / 'simple.thrift')])
+    assert result.exit_code == 0
+    assert (tmp_path / 'simple.thrift').read_text() == expected
+    assert os.stat(tmp_path / 'simple.thrift').st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ['simple.thrift']
+
+    # a symlink is written through
+    with open(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')) as f:
+        (tmp_path / 'target.thrift').write_text(f.read())
+    (tmp_path / 'links').mkdir()
+    (tmp_path / 'links' / 'link.thrift').symlink_to(tmp_path / 'target.thrift')
+    result = runner.invoke(main, ['-j', '1', '-w', str(tmp_path / 'links')])
+    assert result.exit_code == 0
+    assert (tmp_path / 'links' / 'link.thrift').is_symlink()
+    assert (tmp_path / 'target.thrift').read_text() == expected
+
+
+def test_profile():
+    data = ThriftData.from_str('// a\nstruct A {\n1: i32 a = 1, // b\n}')
+    fmt = ThriftFormatter(data)
+    profile = fmt.profile()
+    assert isinstance(profile, FormatProfile)
+
+    before, after = [], []
+    fmt.add_node_hook(before=before.append, after=after.append)
+    out = fmt.format()
+    assert out == '// a\nstruct A {\n    1: required i32 a = 1, // b\n}'
+
+    assert before and sorted(map(id, before)) == sorted(map(id, after))
+    stats = profile.to_dict()
+    assert set(stats['phases']) == {'patch', 'format', 'align', 'comment'}
+    assert stats['counters']['nodes'] == len(before)
+    assert stats['counters']['tokens'] == len(data.tokens)
+    assert stats['counters']['comments'] == 2
+
+
+def walked_node_classes(fmt):
+    # the nodes of the patched tree, the header and definition wrappers are not processed
+    classes = []
+    PureThriftFormatter.walk_node(fmt._patch(), lambda node: classes.append(node.__class__.__name__))
+    return sorted(name for name in classes if name not in ('HeaderContext', 'DefinitionContext'))
+
+
+@pytest.mark.parametrize('option', [Option(), Option(align_field=True), Option(align_assign=True, keep_comment=False)])
+def test_node_hook_coverage(option):
+    source = 'struct A {\n    1: map<string, list<i32>> a = {"k": [1]},\n    2: i32 b\n}\nconst i32 C = 1 // c\n'
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    before = []
+    fmt.add_node_hook(before=before.append)
+    out = fmt.format()
+    assert sorted(node.__class__.__name__ for node in before) == walked_node_classes(fmt)
+
+    class OverrideFormatter(ThriftFormatter):
+        def before_process_node(self, node):
+            super().before_process_node(node)
+            nodes.append(node)
+
+    nodes = []
+    fmt = OverrideFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    assert fmt.format() == out
+    assert sorted(node.__class__.__name__ for node in nodes) == walked_node_classes(fmt)
+
+    # the profile counts the nodes under a cached text too
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    profile = fmt.profile()
+    assert fmt.format() == out
+    assert profile.to_dict()['counters']['nodes'] == len(before)
+
+
+def test_with_click_profile(tmp_path):
+    with open(os.path.join(TEST_DIR, 'fixtures', 'simple.thrift')) as f:
+        (tmp_path / 'simple.thrift').write_text(f.read())
+
+    runner = CliRunner()
+    result = runner.invoke(main, [
+        '--profile', str(tmp_path / 'profile.json'), '--cprofile', str(tmp_path / 'cprofile.pstats'),
+        str(tmp_path / 'simple.thrift')])
+    assert result.exit_code == 0
+    with open(tmp_path / 'profile.json') as f:
+        stats = json.load(f)
+    assert set(stats[str(tmp_path / 'simple.thrift')]['phases']) == {'parse', 'patch', 'format', 'align', 'comment'}
+    assert os.path.getsize(tmp_path / 'cprofile.pstats') > 0
+
+    result = runner.invoke(main, ['--cprofile', str(tmp_path / 'cprofile.pstats'), str(tmp_path)])
+    assert result.exit_code == 1
+
+
+def test_with_click_paths(tmp_path):
+    (tmp_path / 'a.thrift').write_text('include  "a.thrift"')
+    (tmp_path / 'b.thrift').write_text('include  "b.thrift"')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'c.thrift').write_text('include  "c.thrift"')
+
+    runner = CliRunner()
+    a = str(tmp_path / 'a.thrift')
+    result = runner.invoke(main, [a, a, str(tmp_path / '.' / 'a.thrift'), str(tmp_path / 'b.thrift')])
+    assert result.exit_code == 0
+    assert result.output == 'include "a.thrift"\ninclude "b.thrift"\n'
+
+    # the files in a dir are written
+    result = runner.invoke(main, [a, str(tmp_path / 'sub')])
+    assert result.exit_code == 0
+    assert result.output == 'include "a.thrift"\n'
+    assert (tmp_path / 'sub' / 'c.thrift').read_text() == 'include "c.thrift"'
+    assert (tmp_path / 'a.thrift').read_text() == 'include  "a.thrift"'
+
+
+def test_lazy_import():
+    code = '''
+import sys
+from thrift_fmt.main import main
+import thrift_fmt
+assert thrift_fmt.Option
+try:
+    main(['--help'], standalone_mode=False)
+except SystemExit:
+    pass
+assert 'antlr4' not in sys.modules, 'antlr4'
+assert 'thrift_parser' not in sys.modules, 'thrift_parser'
+assert thrift_fmt.ThriftFormatter
+assert 'antlr4' in sys.modules
+'''
+    root = os.path.dirname(TEST_DIR)
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
+
+
+def test_format_range():
+    data = \
+        'include    "a.thrift"   // a\n' \
+        '  /* doc */\n' \
+        'struct   A {\n' \
+        '1: i32 a, // x\n' \
+        '  2:string b\n' \
+        '} // tail A\n' \
+        '\n\n' \
+        'enum   E {  X = 1 }\n'
+
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option())
+    assert fmt.format_range(4, 4) == \
+        'include    "a.thrift"   // a\n' \
+        '/* doc */\n' \
+        'struct A {\n' \
+        '    1: required i32 a,    // x\n' \
+        '    2: required string b,\n' \
+        '} // tail A\n' \
+        '\n\n' \
+        'enum   E {  X = 1 }\n'
+
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option())
+    assert fmt.format_range(7, 8) == data
+
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option())
+    assert fmt.format_range(9, 9) == data.replace('enum   E {  X = 1 }', 'enum E {\n    X = 1,\n}')
+
+
+def test_format_range_same_line():
+    # a tail comment after the next definition is not in the range
+    data = 'const i32 A = 1; const i32 B = 2 // x\nconst i32 C = 3; const i32 D = 4 // y\n'
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option())
+    assert fmt.format_range(1, 1) == 'const i32 A = 1 ; const i32 B = 2 // x\n' + data.split('\n')[1] + '\n'
+
+    data = 'struct S3 {\n    1: i32 a\n} union S4 { /* m */\n    1: i32 b\n}\nconst   i32 Z = 1\n'
+    fmt = ThriftFormatter(ThriftData.from_str(data))
+    fmt.option(Option())
+    assert fmt.format_range(1, 2) == data.replace('1: i32 a', '1: required i32 a,')
+    assert fmt.format_range(6, 6) == data.replace('const   i32', 'const i32')
+
+
+def test_format_range_all():
+    # the whole range of a formatted file is unchanged
+    for file in ['simple.thrift', 'tutorial.thrift', 'ThriftTest.thrift']:
+        out = run_fmt(file)
+        fmt = ThriftFormatter(ThriftData.from_str(out))
+        fmt.option(Option(align_assign=False))
+        assert fmt.format_range(1, out.count('\n') + 1) == out
+
+
+def test_with_click_line_range(tmp_path):
+    (tmp_path / 'a.thrift').write_text('include  "a.thrift"\ninclude  "b.thrift"\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--line-range', '2', '2', str(tmp_path / 'a.thrift')])
+    assert result.exit_code == 0
+    assert result.output == 'include  "a.thrift"\ninclude "b.thrift"\n'
+
+    (tmp_path / 'b.thrift').write_text('include  "b.thrift"\n')
+    result = runner.invoke(main, ['--line-range', '2', '2', str(tmp_path)])
+    assert result.exit_code == 1
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from thrift_parser import ThriftData
+from thrift_fmt import Option, ThriftFormatter
+from thrift_fmt.incremental import IncrementalSession
+from thrift_fmt.parser import parse, ThriftSyntaxError
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_fixture(file):
+    with open(os.path.join(TEST_DIR, 'fixtures', file), newline='') as f:
+        return f.read()
+
+
+def format_all(source, option):
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    return fmt.format()
+
+
+def test_parse_strict():
+    assert parse('struct A {}', strict=True).document.children
+    with pytest.raises(ThriftSyntaxError) as e:
+        parse('struct A {', strict=True)
+    assert e.value.errors
+
+
+@pytest.mark.parametrize('option', [Option(), Option(keep_comment=False), Option(align_field=True)])
+@pytest.mark.parametrize('file', ['simple.thrift', 'tutorial.thrift', 'ThriftTest.thrift'])
+def test_incremental(file, option):
+    source = read_fixture(file)
+    session = IncrementalSession(option)
+    assert session.format(source) == format_all(source, option)
+
+    lines = source.split('\n')
+    edits = [
+        lambda lines, i: lines.insert(i, '// added'),
+        lambda lines, i: lines.insert(i, '/* added */'),
+        lambda lines, i: lines.insert(i, ''),
+        lambda lines, i: lines.__setitem__(i, lines[i] + ' // tail'),
+        lambda lines, i: lines.insert(i, 'typedef i32 Added'),
+    ]
+    for i in range(0, len(lines), max(7, len(lines) // 20)):
+        edited = list(lines)
+        edits[i % len(edits)](edited, i)
+        source = '\n'.join(edited)
+        try:
+            parse(source, strict=True)
+        except ThriftSyntaxError:
+            continue
+        assert session.format(source) == format_all(source, option)
+        lines = edited
+
+
+def test_incremental_reparse():
+    source = \
+        'struct A {\n    1: required i32 a,\n}\n\n' \
+        'struct B {\n    1: required i32 b,\n}\n\n' \
+        'struct C {\n    1: required i32 c,\n}\n'
+    expected = format_all(source.replace('i32 b', 'string b'), Option())
+    session = IncrementalSession()
+    session.format(source)
+    assert session.formatted_chunks == 4
+
+    edited = source.replace('i32 b', 'string   b')
+    assert session.format(edited) == expected
+    assert session.formatted_chunks == 1
+
+    assert session.format(edited) == expected
+    assert session.formatted_chunks == 0
+
+    # the session is kept after a syntax error
+    with pytest.raises(Exception):
+        session.format(edited.replace('struct B {', 'struct B'))
+    assert session.format(source) == format_all(source, Option())
+    assert session.formatted_chunks == 1
+
+
+@pytest.mark.parametrize('source, edits', [
+    ('const i32 A = 1; const i32 B = 2 // x\nconst i32 C = 3; const i32 D = 4 // y\n', [('C = 3', 'C = 33')]),
+    ('struct S {\n} const i32 C4 = 4 # h\nconst i32 E = 5\n', [('C4 = 4', 'C4 = 44'), ('E = 5', 'E = 55')]),
+    ('include "" typedef i32 T // c\nconst i32 E = 5\n', [('i32 T', 'i64 T'), ('E = 5', 'E = 55')]),
+])
+def test_incremental_same_line(source, edits):
+    # the definitions in a line, the tail comment is the one of the last
+    session = IncrementalSession()
+    assert session.format(source) == format_all(source, Option())
+    for old, new in edits:
+        source = source.replace(old, new)
+        assert session.format(source) == format_all(source, Option())
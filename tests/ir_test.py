@@ -0,0 +1,62 @@
+import gc
+import os
+import weakref
+
+from thrift_parser import ThriftData
+from thrift_fmt import ThriftFormatter, Option
+from thrift_fmt.ir import Document, Node, Token, convert_node
+from thrift_fmt import ir
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_document_from_data():
+    source = \
+        '// header\n' \
+        'struct A {\n' \
+        '    1: string a = "a" // a\n' \
+        '    2: list<i32> b\n' \
+        '}\n'
+    data = ThriftData.from_str(source)
+    document = Document.from_data(data)
+
+    assert isinstance(document.root, ir.DocumentContext)
+    assert document.source == source
+    assert document.token_count == len(data.tokens)
+
+    def check(node):
+        assert isinstance(node, Node)
+        assert not hasattr(node, '__dict__')
+        if isinstance(node, ir.TerminalNodeImpl):
+            assert isinstance(node.symbol, Token)
+        for child in getattr(node, 'children', ()):
+            check(child)
+    check(document.root)
+
+    # the antlr tree and tokens are not kept
+    ref = weakref.ref(data.document)
+    del data
+    gc.collect()
+    assert ref() is None
+
+
+def test_format_document():
+    with open(os.path.join(TEST_DIR, 'fixtures', 'ThriftTest.thrift')) as f:
+        source = f.read()
+    data = ThriftData.from_str(source)
+    option = Option(keep_comment=True, align_field=True)
+
+    fmt = ThriftFormatter(data)
+    fmt.option(option)
+    expected = fmt.format()
+
+    fmt = ThriftFormatter(Document.from_data(data))
+    fmt.option(option)
+    assert fmt.format() == expected
+
+
+def test_convert_node():
+    data = ThriftData.from_str('const i32 A = 1')
+    node = convert_node(data.document.children[0])
+    assert isinstance(node, ir.DefinitionContext)
+    assert convert_node(node) is node
@@ -0,0 +1,57 @@
+import glob
+import os
+
+import pytest
+from antlr4 import InputStream, CommonTokenStream
+
+from thrift_parser.ThriftLexer import ThriftLexer
+from thrift_fmt.lexer import tokenize
+from thrift_fmt.parser import parse
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def antlr_tokens(source):
+    stream = CommonTokenStream(ThriftLexer(InputStream(source)))
+    stream.fill()
+    return stream.tokens
+
+
+def token_fields(tokens):
+    return [(t.type, t.channel, t.start, t.stop, t.line, t.column, t.tokenIndex, t.text) for t in tokens]
+
+
+@pytest.mark.parametrize('file', sorted(glob.glob(os.path.join(TEST_DIR, 'fixtures', '*.thrift'))))
+def test_tokenize_fixture(file):
+    with open(file, newline='') as f:
+        source = f.read()
+    assert token_fields(tokenize(source)) == token_fields(antlr_tokens(source))
+
+
+@pytest.mark.parametrize('source', [
+    '',
+    'include "a.thrift"\r\n# tail\r\n',
+    'const double D = -1.5e+3, const i64 H = -0x1F, const i32 I = +1\n',
+    'const string S = "a\\"b\\\\" // c /* d */\n',
+    "const string Q = 'it\\'s\n multi line'\n",
+    '/* a\n * b */ /**/ typedef i32x cpp_includes\n',
+    'const list<double> L = [1.5.2, .5, 0x1g, 1e5]',
+    'a.b._c1 includex i32',
+])
+def test_tokenize(source):
+    assert token_fields(tokenize(source)) == token_fields(antlr_tokens(source))
+
+
+@pytest.mark.parametrize('source', ['// no newline at the end', '"\\q"', '1.', 'a-b', '/* open', '\r', 'é'])
+def test_tokenize_error(source):
+    # left to the antlr lexer, which reports the errors
+    assert tokenize(source) is None
+
+
+def test_parse_regex_lexer():
+    with open(os.path.join(TEST_DIR, 'fixtures', 'ThriftTest.thrift'), newline='') as f:
+        source = f.read()
+    data = parse(source)
+    expected = parse(source, regex_lexer=False)
+    assert token_fields(data.tokens) == token_fields(expected.tokens)
+    assert data.document.toStringTree(recog=None) == expected.document.toStringTree(recog=None)
@@ -0,0 +1,105 @@
+import glob
+import os
+
+from thrift_parser import ThriftData
+from thrift_fmt import ThriftFormatter, Option
+from thrift_fmt.memo import DefinitionMemo
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OPTIONS = [
+    Option(),
+    Option(keep_comment=False),
+    Option(align_field=True, indent=2),
+    Option().disble_patch().disble_align(),
+]
+
+
+def format_source(source, option, memo=None):
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    if memo is not None:
+        fmt.memo(memo)
+    return fmt.format()
+
+
+def test_memo_fixtures():
+    memo = DefinitionMemo()
+    for file in sorted(glob.glob(os.path.join(TEST_DIR, 'fixtures', '*.thrift'))):
+        with open(file, newline='') as f:
+            source = f.read()
+        for option in OPTIONS:
+            expected = format_source(source, option)
+            assert format_source(source, option, memo) == expected, (file, vars(option))
+            # formatted again from the memo
+            hits = memo.hits
+            assert format_source(source, option, memo) == expected, (file, vars(option))
+            assert memo.hits > hits
+
+
+def test_memo_changed_definition():
+    source = \
+        '/* a\n   b */\n' \
+        'include "a.thrift"\n\n' \
+        'struct A {\n    1: i32 a = 1 // a\n}\n' \
+        '// b\n' \
+        'enum B { X, Y }\n' \
+        'service C {\n    void f(1: i32 a)\n}\n'
+    memo = DefinitionMemo()
+    format_source(source, Option(), memo)
+    assert memo.misses == len(memo) == 5  # with the EOF
+
+    edited = source.replace('X, Y', 'X, Y, Z')
+    assert format_source(edited, Option(), memo) == format_source(edited, Option())
+    assert memo.misses == 6
+    assert memo.hits == 4
+
+    # the first definition moved to the middle is formatted again
+    moved = 'include "b.thrift"\n' + source
+    assert format_source(moved, Option(), memo) == format_source(moved, Option())
+
+
+def test_memo_lru():
+    source = 'struct A {}\nstruct B {}\n'  # 3 chunks with the EOF
+    memo = DefinitionMemo(max_entries=3)
+    format_source(source, Option(), memo)
+    format_source(source, Option(), memo)
+    assert memo.hits == 3
+
+    memo = DefinitionMemo(max_entries=2)
+    format_source(source, Option(), memo)
+    assert len(memo) == 2
+    format_source('struct B {}\n', Option(), memo)
+    assert memo.hits == 1  # the EOF, B was the first of the document
+
+
+def test_memo_shared():
+    fmt = ThriftFormatter(ThriftData.from_str('struct A {}'))
+    memo = fmt.memo()
+    assert ThriftFormatter(ThriftData.from_str('struct B {}')).memo() is memo
+
+
+def test_tail_comments(monkeypatch):
+    from thrift_fmt import parallel
+    from thrift_fmt.incremental import IncrementalSession
+
+    monkeypatch.setattr(parallel, 'MIN_GROUP_SIZE', 1)
+    source = \
+        'const i32 A = 1 /* x */ /* y */\n' \
+        'const i32 B = 2\n' \
+        'struct C {} /* i */ // c\n' \
+        'const i32 D = 3 /* a */ /* b */ /* c */\n' \
+        'struct E {\n    1: i32 e /* e */ // e\n}\n' \
+        'const i32 F = 1; const i32 G = 2 // x\n' \
+        'const i32 H = 3; const i32 I = 4 // y\n'
+    for option in OPTIONS:
+        expected = format_source(source, option)
+        assert format_source(source, option, DefinitionMemo()) == expected
+        assert parallel.format_parallel(source, option, jobs=2) == expected
+
+        session = IncrementalSession(option)
+        assert session.format(source) == expected
+        edited = source.replace('= 2', '= 4')
+        assert session.format(edited) == format_source(edited, option)
+    assert format_source(source, Option()).startswith('const i32 A = 1 /* x */ /* y */\nconst i32 B = 2\n')
+    assert format_source(source, Option()).endswith('const i32 H = 3 ;\nconst i32 I = 4 // y')
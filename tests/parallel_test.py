@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from thrift_parser import ThriftData
+from thrift_fmt import Option, ThriftFormatter
+from thrift_fmt import parallel
+from thrift_fmt.parallel import split_groups
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_split_groups():
+    source = 'struct A {} // a\nstruct B {}\n\nstruct C {}\n'
+    bounds = [17, 28]
+    assert split_groups(source, bounds, 2, 0) == [(0, 28), (28, len(source))]
+    assert split_groups(source, bounds, 3, 0) == [(0, 17), (17, len(source))]
+    assert split_groups(source, bounds, 1, 0) == [(0, len(source))]
+    assert split_groups(source, bounds, 2, 20) == [(0, len(source))]
+
+    # a tail comment is never split from its definition
+    source = 'struct A {}\nstruct B {} /* b */ struct C {}\n'
+    assert split_groups(source, [12, 23], 4, 0) == [(0, 12), (12, len(source))]
+
+
+@pytest.mark.parametrize('option', [Option(), Option(keep_comment=False), Option(align_field=True)])
+@pytest.mark.parametrize('file', ['simple.thrift', 'tutorial.thrift', 'ThriftTest.thrift', 'AnnotationTest.thrift'])
+def test_format_parallel(file, option, monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_GROUP_SIZE', 1)
+    with open(os.path.join(TEST_DIR, 'fixtures', file), newline='') as f:
+        source = f.read()
+
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    expected = fmt.format()
+
+    fmt = ThriftFormatter(ThriftData.from_str(source))
+    fmt.option(option)
+    assert fmt.format_parallel(3) == expected
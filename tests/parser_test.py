@@ -0,0 +1,33 @@
+import glob
+import os
+
+import pytest
+from antlr4.tree.Trees import Trees
+
+from thrift_parser import ThriftData
+from thrift_fmt.parser import parse, ThriftSyntaxError
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.mark.parametrize('file', sorted(glob.glob(os.path.join(TEST_DIR, 'fixtures', '*.thrift'))))
+def test_parse_sll(file):
+    expected = ThriftData.from_file(file)
+    with open(file, newline='') as f:
+        source = f.read()
+
+    for sll in (True, False):
+        data = parse(source, sll=sll)
+        assert [token.text for token in data.tokens] == [token.text for token in expected.tokens]
+        assert Trees.toStringTree(data.document) == Trees.toStringTree(expected.document)
+
+
+def test_parse_sll_error():
+    source = 'struct A {\n    1: i32 a\n}\n}\n'
+    with pytest.raises(ThriftSyntaxError) as ll_error:
+        parse(source, strict=True, sll=False)
+    # reported by the full LL parse after the SLL one bails out
+    with pytest.raises(ThriftSyntaxError) as error:
+        parse(source, strict=True)
+    assert error.value.errors == ll_error.value.errors
+    assert error.value.errors[0].startswith('line 4:0 extraneous input')
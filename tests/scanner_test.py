@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from thrift_fmt import ThriftFormatter
+from thrift_fmt.parser import parse
+from thrift_fmt.incremental import chunk_spans
+from thrift_fmt.scanner import scan_definitions, definition_bounds, Definition
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def tree_definitions(source):
+    fmt = ThriftFormatter(parse(source, strict=True))
+    return fmt, [(node.start.start, last.stop + 1) for node, _, last, _ in fmt._definition_segments()]
+
+
+def test_scan_definitions():
+    source = \
+        'include "a.thrift" // a\n' \
+        'const string S = "struct { // not a comment" /* s */ # s\n' \
+        "const string Q = 'it\\'s }'\n" \
+        '/* struct X {} */\n' \
+        'struct A {\n' \
+        '    1: string a = "}", // }\n' \
+        '} (a = "service")\n' \
+        'senum S { "a" }\n' \
+        'enum E { A, B } struct B {} // b\n'
+
+    definitions = scan_definitions(source)
+    assert [d.kind for d in definitions] == ['include', 'const', 'const', 'struct', 'senum', 'enum', 'struct']
+    assert definitions[0] == Definition('include', 0, source.index('\n') + 1)
+    assert source[definitions[1].start:definitions[1].end] == \
+        'const string S = "struct { // not a comment" /* s */ # s\n'
+    # the tail comment is the one of the last definition in the line
+    assert source[definitions[5].start:definitions[5].end] == 'enum E { A, B }'
+    assert [(d.start, d.end) for d in definitions] == tree_definitions(source)[1]
+
+
+@pytest.mark.parametrize('file', [
+    'simple.thrift', 'tutorial.thrift', 'ThriftTest.thrift', 'AnnotationTest.thrift',
+    'shared.thrift', 'namespace.thrift',
+])
+def test_scan_fixtures(file):
+    with open(os.path.join(TEST_DIR, 'fixtures', file), newline='') as f:
+        source = f.read()
+
+    fmt, definitions = tree_definitions(source)
+    assert [(d.start, d.end) for d in scan_definitions(source)] == definitions
+    assert definition_bounds(source) == [end for _, end, _, _ in chunk_spans(fmt)[:-1]]
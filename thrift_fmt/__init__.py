@@ -1 +1,14 @@
-from .core import ThriftFormatter, PureThriftFormatter, Option # noqa
+from .option import Option  # noqa
+
+__all__ = ['ThriftFormatter', 'PureThriftFormatter', 'Option', 'warmup']
+
+
+def __getattr__(name: str):
+    # the formatters load antlr4 and the generated parser, so import them on first use
+    if name in ('ThriftFormatter', 'PureThriftFormatter'):
+        from . import core
+        return getattr(core, name)
+    if name == 'warmup':
+        from . import dfa_cache
+        return dfa_cache.warmup
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
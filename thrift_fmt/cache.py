@@ -0,0 +1,138 @@
+from __future__ import annotations
+import hashlib
+import importlib
+import io
+import json
+import os
+import pathlib
+import tempfile
+import time
+from typing import Dict, Optional
+
+from .option import Option
+
+
+CACHE_DIR_ENV: str = 'THRIFT_FMT_CACHE_DIR'
+CACHE_VERSION: str = '1'  # bump it when the cache file layout changes
+MAX_ENTRIES: int = 20000
+
+
+def get_cache_dir() -> pathlib.Path:
+    cache_dir: Optional[str] = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return pathlib.Path(cache_dir)
+    cache_home: str = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return pathlib.Path(cache_home) / 'thrift-fmt'
+
+
+def _metadata_version(package: str) -> Optional[str]:
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        try:
+            # python3.7 with the backport
+            from importlib_metadata import version  # type: ignore
+        except ImportError:
+            version = None
+    try:
+        if version is not None:
+            return version(package)
+        import pkg_resources
+        return pkg_resources.get_distribution(package).version
+    except Exception:
+        return None
+
+
+def _source_digest(module: str) -> Optional[str]:
+    # an uninstalled package, as a checkout, is known by the content of its sources
+    try:
+        root = pathlib.Path(importlib.import_module(module).__file__).parent
+    except Exception:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for file in sorted(root.rglob('*.py')):
+        digest.update(str(file.relative_to(root)).encode('utf8'))
+        digest.update(file.read_bytes())
+    return 'source-' + digest.hexdigest()
+
+
+def get_version(package: str, module: Optional[str] = None) -> str:
+    '''
+        the installed version of the package, or the digest of the sources of its
+        module if it has no metadata. 'unknown' if neither is found
+    '''
+    return _metadata_version(package) or (module and _source_digest(module)) or 'unknown'
+
+
+class Cache:
+    '''
+        remember the content hash of the sources already formatted under an option,
+        so they can be skipped without parsing.
+
+        only a source whose output equals itself is remembered, so a formatter
+        change that is not idempotent can never hide a file from formatting.
+    '''
+
+    def __init__(self, option: Option, cache_dir: Optional[pathlib.Path] = None,
+                 max_entries: int = MAX_ENTRIES):
+        self._max_entries: int = max_entries
+        self._file: pathlib.Path = (cache_dir or get_cache_dir()) / 'cache.{}.json'.format(self._key(option))
+        # content hash -> last used time
+        self._entries: Dict[str, float] = self._load()
+        self._changed: bool = False
+
+    @staticmethod
+    def _key(option: Option) -> str:
+        key = json.dumps({
+            'cache': CACHE_VERSION,
+            'thrift-fmt': get_version('thrift-fmt', 'thrift_fmt'),
+            'thrift-parser': get_version('thrift-parser', 'thrift_parser'),
+            'option': vars(option),
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode('utf8')).hexdigest()[:32]
+
+    @staticmethod
+    def hash(source: str) -> str:
+        return hashlib.sha256(source.encode('utf8')).hexdigest()
+
+    def _load(self) -> Dict[str, float]:
+        try:
+            with io.open(self._file, 'r', encoding='utf8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def is_formatted(self, source: str) -> bool:
+        source_hash: str = self.hash(source)
+        if source_hash not in self._entries:
+            return False
+        self._entries[source_hash] = time.time()
+        self._changed = True
+        return True
+
+    def add(self, source: str):
+        self._entries[self.hash(source)] = time.time()
+        self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+
+        # evict the least recently used entries
+        if len(self._entries) > self._max_entries:
+            entries = sorted(self._entries.items(), key=lambda item: item[1], reverse=True)
+            self._entries = dict(entries[:self._max_entries])
+
+        try:
+            self._file.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', encoding='utf8', dir=str(self._file.parent),
+                                             delete=False) as f:
+                json.dump(self._entries, f)
+            os.replace(f.name, str(self._file))
+        except OSError:
+            # the cache is only an optimization
+            return
+        self._changed = False
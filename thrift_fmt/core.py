@@ -1,107 +1,162 @@
 from __future__ import annotations
+import collections
+import contextlib
 import copy
-import io
+import time
 import typing
-from typing import List, Optional, Callable, Tuple, Dict
+from typing import List, Optional, Callable, Tuple, Dict, Deque, ContextManager, Union, Iterator, TextIO, Set
 
-from antlr4.Token import CommonToken
-from antlr4.tree.Tree import TerminalNodeImpl
 from antlr4.tree.Tree import ParseTree
 
 from thrift_parser import ThriftData
 from thrift_parser.ThriftParser import ThriftParser
 
+from . import ir
+from .ir import Token, Node, TerminalNodeImpl, CommentIndex, Document
+from .option import Option
+
+if typing.TYPE_CHECKING:
+    from .memo import DefinitionMemo
+
 
 FAKE_FIELD_REQ_TYPE: int = 21  # copy from thrirft_parser. generate by antlr4
 FAKE_SEP_TOKEN_TEXT: str = ','  # fake separator token, we use comma
 
 
-class Option:
-    DEFAULT_INDENT: int = 4
+class FormatProfile:
+    '''
+        the stats of the formats with `ThriftFormatter.profile`, the seconds of
+        each phase and the counters. `align` and `comment` are parts of `format`.
+    '''
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase: str):
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
 
-    def __init__(self, patch_sep: bool = True, patch_required: bool = True,
-                 keep_comment: bool = True, indent: Optional[int] = None,
-                 align_assign: bool = True, align_field: bool = False):
+    def count(self, counter: str, n: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
 
-        self.patch_sep: bool = patch_sep
-        self.patch_required: bool = patch_required
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return {'phases': dict(self.phases), 'counters': dict(self.counters)}
 
-        self.keep_comment: bool = keep_comment
-        self.indent: int = self.DEFAULT_INDENT
-        if indent and indent > 0:
-            self.indent = indent
 
-        self.align_assign: bool = align_assign
-        self.align_field: bool = align_field
+class OutputWriter:
+    '''
+        collect the formatted text, newlines are delayed until the next push.
+        the column of the current line is tracked while writing, so alignment
+        never needs to read back the text already written.
+    '''
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._column: int = 0
+        self.pending_newlines: int = 0
 
-    def disble_patch(self) -> Option:
-        self.patch_required = False
-        self.patch_sep = False
-        return self
+    def push(self, text: str):
+        if self.pending_newlines > 0:
+            self._write('\n' * self.pending_newlines)
+            self.pending_newlines = 0
+        self._write(text)
 
-    def disble_align(self) -> Option:
-        self.align_field = False
-        self.align_assign = False
-        return self
+    def append(self, text: str):
+        self._write(text)
+
+    def newline(self, repeat: int = 1):
+        self.pending_newlines = max(self.pending_newlines, repeat)
 
     @property
-    def is_align(self):
-        return self.align_field or self.align_assign
+    def column(self) -> int:
+        if self.pending_newlines > 0:
+            return 0
+        return self._column
+
+    def getvalue(self) -> str:
+        return ''.join(self._parts)
+
+    def take(self) -> str:
+        '''
+            the text written since the last take, it is not kept by the writer
+        '''
+        text: str = ''.join(self._parts)
+        self._parts.clear()
+        return text
+
+    def mark(self) -> int:
+        return len(self._parts)
+
+    def since(self, mark: int) -> str:
+        return ''.join(self._parts[mark:])
+
+    def _write(self, text: str):
+        if not text:
+            return
+        self._parts.append(text)
+        i = text.rfind('\n')
+        if i < 0:
+            self._column += len(text)
+        else:
+            self._column = len(text) - i - 1
 
 
 class PureThriftFormatter:
+    # node class -> handler, filled on first use
+    _handlers: Dict[type, Callable[[PureThriftFormatter, Node], None]] = {}
 
     def __init__(self):
         self._option: Option = Option()
 
-        self._out: io.StringIO = io.StringIO()
-        self._newline_c: int = 0
+        self._out: OutputWriter = OutputWriter()
         self._indent_s: str = ''
 
     def option(self, option: Option):
         self._option = option
 
-    def format_node(self, node: ParseTree) -> str:
-        self._out: io.StringIO = io.StringIO()
-        self._newline_c: int = 0
+    def format_node(self, node: Union[Node, ParseTree]) -> str:
+        self._out: OutputWriter = OutputWriter()
         self._indent_s: str = ''
 
-        self.process_node(node)
+        # an antlr node is converted first
+        self.process_node(ir.convert_node(node))
         return self._out.getvalue()
 
     def _push(self, text: str):
-        if self._newline_c > 0:
-            self._out.write('\n' * self._newline_c)
-            self._newline_c = 0
-        self._out.write(text)
+        self._out.push(text)
 
     def _append(self, text: str):
-        self._out.write(text)
+        self._out.append(text)
 
     def _newline(self, repeat: int = 1):
-        diff = repeat - self._newline_c
-        if diff <= 0:
-            return
-        self._newline_c += diff
+        self._out.newline(repeat)
 
     def _indent(self, indent: str = ''):
         self._indent_s = indent
 
     @staticmethod
-    def walk_node(root: ParseTree, fn: Callable[[ParseTree], None]):
-        nodes: List[ParseTree] = [root]
+    def walk_node(root: Node, fn: Callable[[Node], None]):
+        nodes: Deque[Node] = collections.deque([root])
         while nodes:
-            node: ParseTree = nodes.pop(0)
+            node: Node = nodes.popleft()
             fn(node)
-            if not isinstance(node, TerminalNodeImpl):
-                for child in node.children:
-                    child.parent = node
-                    nodes.append(child)
+            # an antlr tree can be walked too
+            for child in getattr(node, 'children', None) or ():
+                child.parent = node
+                nodes.append(child)
 
     @staticmethod
-    def _split_repeat_children(nodes: List[ParseTree], cls: typing.Type[ParseTree]) \
-            -> Tuple[List[ParseTree], List[ParseTree]]:
-        children: List[ParseTree] = []
+    def _split_repeat_children(nodes: List[Node], cls: typing.Type[Node]) \
+            -> Tuple[List[Node], List[Node]]:
+        children: List[Node] = []
         for i, child in enumerate(nodes):
             if not isinstance(child, cls):
                 return children, nodes[i:]
@@ -109,33 +164,39 @@ class PureThriftFormatter:
         return children, []
 
     @staticmethod
-    def _is_EOF(node: ParseTree):
+    def _is_EOF(node: Node):
         return isinstance(node, TerminalNodeImpl) and node.symbol.type == ThriftParser.EOF
 
     @staticmethod
-    def _is_token(node: ParseTree, text: str):
+    def _is_token(node: Node, text: str):
         return isinstance(node, TerminalNodeImpl) and node.symbol.text == text
 
     @staticmethod
-    def _is_newline_node(node: ParseTree):
+    def _is_newline_node(node: Node):
         return isinstance(node, (
-            ThriftParser.Enum_ruleContext,
-            ThriftParser.Struct_Context,
-            ThriftParser.Union_Context,
-            ThriftParser.Exception_Context,
-            ThriftParser.ServiceContext,
+            ir.Enum_ruleContext,
+            ir.Struct_Context,
+            ir.Union_Context,
+            ir.Exception_Context,
+            ir.ServiceContext,
         ))
 
     @staticmethod
-    def _get_parent(node: ParseTree):
-        if hasattr(node, 'parent'):
-            return node.parent
-        return None
+    def _get_parent(node: Node):
+        # parentCtx is linked by the parser, and by the patches for fake nodes
+        return getattr(node, 'parentCtx', None)
+
+    def _block_nodes(self, nodes: List[Node], indent: str = ''):
+        for _ in self._iter_block_nodes(nodes, indent):
+            pass
 
-    def _block_nodes(self, nodes: List[ParseTree], indent: str = ''):
+    def _iter_block_nodes(self, nodes: List[Node], indent: str = '') -> Iterator[Node]:
+        '''
+            like _block_nodes, yield each node once it is processed
+        '''
         last_node = None
         for i, node in enumerate(nodes):
-            if isinstance(node, (ThriftParser.HeaderContext, ThriftParser.DefinitionContext)):
+            if isinstance(node, (ir.HeaderContext, ir.DefinitionContext)):
                 node = node.children[0]
 
             self.before_block_node(node)
@@ -149,8 +210,9 @@ class PureThriftFormatter:
             self.process_node(node)
             self.after_block_node(node)
             last_node = node
+            yield node
 
-    def _inline_nodes(self, nodes: List[ParseTree], join: str = ' '):
+    def _inline_nodes(self, nodes: List[Node], join: str = ' '):
         for i, node in enumerate(nodes):
             if i > 0:
                 self._push(join)
@@ -159,8 +221,8 @@ class PureThriftFormatter:
     @staticmethod
     def gen_inline_Context(
             join: str = ' ',
-            tight_fn: Optional[Callable[[int, ParseTree], bool]] = None):
-        def fn(self: PureThriftFormatter, node: ParseTree):
+            tight_fn: Optional[Callable[[int, Node], bool]] = None):
+        def fn(self: PureThriftFormatter, node: Node):
             for i, child in enumerate(node.children):
                 if i > 0 and len(join) > 0:
                     if not tight_fn or not tight_fn(i, child):
@@ -169,8 +231,8 @@ class PureThriftFormatter:
         return fn
 
     @staticmethod
-    def gen_subblocks_Context(start: int, field_class: typing.Type[ParseTree]):
-        def fn(self: PureThriftFormatter, node: ParseTree):
+    def gen_subblocks_Context(start: int, field_class: typing.Type[Node]):
+        def fn(self: PureThriftFormatter, node: Node):
             self._inline_nodes(node.children[:start])
             self._newline()
 
@@ -186,34 +248,42 @@ class PureThriftFormatter:
     _gen_inline_Context = gen_inline_Context.__func__
     _gen_subblocks_Context = gen_subblocks_Context.__func__
 
-    def before_subblocks(self, _: List[ParseTree]):
+    def before_subblocks(self, _: List[Node]):
         pass
 
-    def after_subblocks(self, _: List[ParseTree]):
+    def after_subblocks(self, _: List[Node]):
         pass
 
-    def before_block_node(self, _: ParseTree):
+    def before_block_node(self, _: Node):
         pass
 
-    def after_block_node(self, _: ParseTree):
+    def after_block_node(self, _: Node):
         pass
 
-    def before_process_node(self, _: ParseTree):
+    def before_process_node(self, _: Node):
         pass
 
-    def after_process_node(self, _: ParseTree):
+    def after_process_node(self, _: Node):
         pass
 
-    def process_node(self, node: ParseTree):
-        if not isinstance(node, TerminalNodeImpl):
-            for child in node.children:
-                child.parent = node
-
-        method_name: str = node.__class__.__name__.split('.')[-1]
-        fn: Optional[Callable[[ParseTree], None]] = getattr(self, method_name, None)
-        assert fn
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # each formatter class has its own table, so overrides are respected
+        cls._handlers = {}
+
+    @classmethod
+    def _get_handler(cls, node_class: type) -> Callable[[PureThriftFormatter, Node], None]:
+        handler = cls._handlers.get(node_class)
+        if handler is None:
+            handler = getattr(cls, node_class.__name__, None)
+            assert handler
+            cls._handlers[node_class] = handler
+        return handler
+
+    def process_node(self, node: Node):
+        handler = self._get_handler(node.__class__)
         self.before_process_node(node)
-        fn(node)
+        handler(self, node)
         self.after_process_node(node)
 
     def TerminalNodeImpl(self, node: TerminalNodeImpl):
@@ -228,13 +298,13 @@ class PureThriftFormatter:
 
         self._push(node.symbol.text)
 
-    def DocumentContext(self, node: ThriftParser.DocumentContext):
+    def DocumentContext(self, node: ir.DocumentContext):
         self._block_nodes(node.children)
 
-    def HeaderContext(self, node: ThriftParser.HeaderContext):
+    def HeaderContext(self, node: ir.HeaderContext):
         self.process_node(node.children[0])
 
-    def DefinitionContext(self, node: ThriftParser.DefinitionContext):
+    def DefinitionContext(self, node: ir.DefinitionContext):
         self.process_node(node.children[0])
 
     Include_Context = _gen_inline_Context()
@@ -256,25 +326,25 @@ class PureThriftFormatter:
     Field_reqContext = _gen_inline_Context()
     Field_typeContext = _gen_inline_Context()
     Map_typeContext = _gen_inline_Context(
-        tight_fn=lambda i, n: not PureThriftFormatter._is_token(n.parent.children[i-1], ','))
+        tight_fn=lambda i, n: not PureThriftFormatter._is_token(n.parentCtx.children[i-1], ','))
     Const_listContext = _gen_inline_Context(
-        tight_fn=lambda _, n: isinstance(n, ThriftParser.List_separatorContext))
-    Enum_ruleContext = _gen_subblocks_Context(3, ThriftParser.Enum_fieldContext)
-    Struct_Context = _gen_subblocks_Context(3, ThriftParser.FieldContext)
-    Union_Context = _gen_subblocks_Context(3, ThriftParser.FieldContext)
-    Exception_Context = _gen_subblocks_Context(3, ThriftParser.FieldContext)
+        tight_fn=lambda _, n: isinstance(n, ir.List_separatorContext))
+    Enum_ruleContext = _gen_subblocks_Context(3, ir.Enum_fieldContext)
+    Struct_Context = _gen_subblocks_Context(3, ir.FieldContext)
+    Union_Context = _gen_subblocks_Context(3, ir.FieldContext)
+    Exception_Context = _gen_subblocks_Context(3, ir.FieldContext)
     Enum_fieldContext = _gen_inline_Context(
         join=' ',
-        tight_fn=lambda _, n: isinstance(n, ThriftParser.List_separatorContext))
+        tight_fn=lambda _, n: isinstance(n, ir.List_separatorContext))
     FieldContext = _gen_inline_Context(
-        tight_fn=lambda _, n: isinstance(n, ThriftParser.List_separatorContext))
+        tight_fn=lambda _, n: isinstance(n, ir.List_separatorContext))
     # (xxx, xxx)
     _tuple_tight_inline = _gen_inline_Context(
         tight_fn=lambda i, n:
             PureThriftFormatter._is_token(n, '(')
             or PureThriftFormatter._is_token(n, ')')
-            or PureThriftFormatter._is_token(n.parent.children[i-1], '(')
-            or isinstance(n, ThriftParser.List_separatorContext)
+            or PureThriftFormatter._is_token(n.parentCtx.children[i-1], '(')
+            or isinstance(n, ir.List_separatorContext)
     )
     Function_Context = _tuple_tight_inline
     OnewayContext = _gen_inline_Context()
@@ -284,127 +354,384 @@ class PureThriftFormatter:
     Type_annotationContext = _tuple_tight_inline
     Annotation_valueContext = _gen_inline_Context()
 
-    def ServiceContext(self, node: ThriftParser.ServiceContext):
-        fn = self.gen_subblocks_Context(3, ThriftParser.Function_Context)
+    def ServiceContext(self, node: ir.ServiceContext):
+        fn = self.gen_subblocks_Context(3, ir.Function_Context)
         if self._is_token(node.children[2], 'extends'):
-            fn = self.gen_subblocks_Context(5, ThriftParser.Function_Context)
+            fn = self.gen_subblocks_Context(5, ir.Function_Context)
         return fn(self, node)
 
-    def SenumContext(self, _: ThriftParser.SenumContext):
+    def SenumContext(self, _: ir.SenumContext):
         # deprecated
         pass
 
 
+class NodeMeasure(PureThriftFormatter):
+    '''
+        render inline subtrees (fields, enum fields, functions) once and cache
+        the text by node identity, every subtree rendered along the way is
+        cached too, so measuring a field and then its children costs nothing.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        # keep the node in the value, so the id is not reused while cached
+        self._texts: Dict[int, Tuple[Node, str]] = {}
+
+    def get(self, node: Node) -> Optional[str]:
+        cached = self._texts.get(id(node))
+        if cached is None:
+            return None
+        return cached[1]
+
+    def text(self, node: Node) -> str:
+        cached = self.get(node)
+        if cached is not None:
+            return cached
+        return self.format_node(node)
+
+    def width(self, node: Node) -> int:
+        return len(self.text(node))
+
+    def process_node(self, node: Node):
+        cached = self.get(node)
+        if cached is not None:
+            self._push(cached)
+            return
+
+        mark = self._out.mark()
+        super().process_node(node)
+        self._texts[id(node)] = (node, self._out.since(mark))
+
+
 class ThriftFormatter(PureThriftFormatter):
-    def __init__(self, data: ThriftData):
+    def __init__(self, data: Union[ThriftData, Document]):
+        '''
+            the parsed data is converted to the compact tree and not kept,
+            so the antlr tree and tokens can be freed by the caller
+        '''
         super().__init__()
 
-        self._data: ThriftData = data
-        self._document: ThriftParser.DocumentContext = data.document
+        self._ir: Document = data if isinstance(data, Document) else Document.from_data(data)
+        self._document: ir.DocumentContext = self._ir.root
+        self._comments: CommentIndex = self._ir.comments
+        self._source: str = self._ir.source
 
         self._last_token_index: int = -1
+        self._measure: NodeMeasure = NodeMeasure()
 
         self._field_comment_padding: int = 0
         self._field_align_assign_padding: int = 0
         self._field_align_padding_map: Dict[str, int] = {}
 
+        self._profile: Optional[FormatProfile] = None
+        self._memo: Optional[DefinitionMemo] = None
+        self._before_hooks: List[Callable[[Node], None]] = []
+        self._after_hooks: List[Callable[[Node], None]] = []
+
+    def profile(self, profile: Optional[FormatProfile] = None) -> FormatProfile:
+        '''
+            collect the phase timers and the counters of the following formats
+        '''
+        self._profile = profile or FormatProfile()
+        return self._profile
+
+    def memo(self, memo: Optional[DefinitionMemo] = None) -> DefinitionMemo:
+        '''
+            reuse the output of the top level definitions formatted before under the
+            same option, by any formatter with the memo, the one of the process by default.
+            the hooks are not called for the nodes of the reused definitions.
+        '''
+        if memo is None:
+            from .memo import shared_memo
+            memo = shared_memo
+        self._memo = memo
+        return memo
+
+    def add_node_hook(self, before: Optional[Callable[[Node], None]] = None,
+                      after: Optional[Callable[[Node], None]] = None):
+        '''
+            call `before`/`after` with each node processed, in before_process_node/after_process_node.
+            the texts cached by the alignment measurement are not reused while a hook is added
+        '''
+        if before:
+            self._before_hooks.append(before)
+        if after:
+            self._after_hooks.append(after)
+
+    def _phase(self, phase: str) -> ContextManager:
+        if self._profile is None:
+            return contextlib.nullcontext()
+        return self._profile.phase(phase)
+
+    def _count_document(self):
+        if self._profile is not None:
+            self._profile.count('tokens', self._ir.token_count)
+            self._profile.count('comments', self._comments.count(-1, self._ir.token_count))
+
+    def reset(self):
+        '''
+            clear the state left by a format. the tree is never changed by a format,
+            so a formatter can format again, after `option` to another one too.
+        '''
+        self._measure = NodeMeasure()
+        self._out = OutputWriter()
+        self._indent_s = ''
+        self._last_token_index = -1
+        self._field_comment_padding = 0
+        self._field_align_assign_padding = 0
+        self._field_align_padding_map = {}
+
     def format(self) -> str:
-        self._patch()
-        return self.format_node(self._document)
+        return ''.join(self.iter_format())
+
+    def iter_format(self) -> Iterator[str]:
+        '''
+            yield the output of each top level node once it is formatted, the text
+            joined is the output of `format`. the newlines after a node are held
+            until the next one, so the output never ends with a newline.
+        '''
+        if self._memo is not None:
+            yield from self._iter_format_memo()
+            return
+
+        with self._phase('patch'):
+            document: ir.DocumentContext = self._patch()
+        with self._phase('format'):
+            self.reset()
+            self.before_process_node(document)
+            nodes: Iterator[Node] = self._iter_block_nodes(document.children)
+
+        while True:
+            with self._phase('format'):
+                done: bool = next(nodes, None) is None
+                if done:
+                    self.after_process_node(document)
+                text: str = self._out.take()
+            if text:
+                yield text
+            if done:
+                break
+        self._count_document()
 
-    def _patch(self):
-        if self._option.patch_required:
-            self.walk_node(self._document, self._patch_field_req)
+    def _iter_format_memo(self) -> Iterator[str]:
+        from .incremental import iter_join_chunks
+        from .memo import iter_memo_chunks
 
-        if self._option.patch_sep:
-            self.walk_node(self._document, self._patch_field_list_separator)
-            self.walk_node(self._document, self._patch_remove_last_list_separator)
+        hits: int = self._memo.hits
+        yield from iter_join_chunks(iter_memo_chunks(self, self._memo))
+        if self._profile is not None:
+            self._profile.count('memo_hits', self._memo.hits - hits)
+        self._count_document()
+
+    def format_to(self, stream: TextIO):
+        '''
+            write the output of `format` to the stream by the top level nodes,
+            the whole output is never held in memory
+        '''
+        for text in self.iter_format():
+            stream.write(text)
+
+    def format_parallel(self, jobs: Optional[int] = None) -> str:
+        '''
+            the same output as format, for a large document, the groups of the top
+            level definitions are parsed and formatted by `jobs` processes.
+        '''
+        from .parallel import format_parallel
+        return format_parallel(self._source, self._option, jobs, data=self._ir)
+
+    def format_range(self, start_line: int, end_line: int) -> str:
+        '''
+            format only the top level definitions (with their comments) overlap
+            the lines [start_line, end_line] (1-based), the other text of the
+            document is kept byte-identical.
+        '''
+        source: str = self._source
+
+        outs: List[str] = []
+        pos: int = 0  # the source before pos is in outs
+        for node, first, last, last_token_index in self._definition_segments():
+            last_line: int = last.line + last.text.rstrip('\r\n').count('\n')
+            if last_line < start_line or first.line > end_line:
+                continue
+
+            # replace the indent before the definition too
+            begin: int = source.rfind('\n', 0, first.start) + 1
+            if begin < pos or source[begin:first.start].strip():
+                begin = first.start
+            end: int = last.start + len(last.text.rstrip('\r\n'))
+            outs.append(source[pos:begin])
+            # drop the newlines before the leading comment
+            outs.append(self._format_definitions([node], last_token_index).lstrip('\n'))
+            pos = end
+
+        outs.append(source[pos:])
+        return ''.join(outs)
+
+    def _definition_segments(self) -> List[Tuple[Node, Token, Token, int]]:
+        '''
+            split the document by the top level nodes, a node owns its leading comments
+            and the tail comment in its last line. return (node, first token, last token,
+            the last token index of the previous node) for each one, EOF is not included.
+        '''
+        segments: List[Tuple[Node, Token, Token, int]] = []
+        last_index: int = -1
+        for node in self._document.children:
+            if self._is_EOF(node) or node.start is None or node.stop is None:
+                continue
+
+            first: Token = node.start
+            comments: List[Token] = self._comments.between(last_index, node.start.tokenIndex)
+            if comments:
+                first = comments[0]
+            # the tail comment and the comments next to it, as `_tail_comment`
+            last: Token = node.stop
+            tail: Optional[Token] = self._comments.tail(last.tokenIndex)
+            while tail is not None:
+                last = tail
+                tail = self._comments.tail(last.tokenIndex)
+
+            segments.append((node, first, last, last_index))
+            last_index = last.tokenIndex
+        return segments
+
+    def _format_definitions(self, nodes: List[Node], last_token_index: int) -> str:
+        '''
+            format some top level nodes with their comments after the token last_token_index,
+            the leading newlines of the output are the newlines wanted before the nodes.
+        '''
+        with self._phase('patch'):
+            nodes = [self._patch_tree(node) for node in nodes]
+        with self._phase('format'):
+            self.reset()
+            self._last_token_index = last_token_index
+
+            self._block_nodes(nodes)
+        return self._out.getvalue()
+
+    def _patch(self) -> ir.DocumentContext:
+        return self._patch_tree(self._document)
+
+    def _patch_tree(self, root: Node) -> Node:
+        '''
+            return the tree patched by all the enabled patches, the tree is not changed:
+            a patched node is a copy with its own children list, the nodes above it are
+            copied too, and the unchanged subtrees are shared with the tree.
+        '''
+        patch_required: bool = self._option.patch_required
+        patch_sep: bool = self._option.patch_sep
+        if not patch_required and not patch_sep:
+            return root
+
+        # the nodes with their next brother, the parents before the children
+        order: List[Tuple[Node, Optional[Node]]] = []
+        nodes: List[Tuple[Node, Optional[Node]]] = [(root, None)]
+        while nodes:
+            node, brother = nodes.pop()
+            if isinstance(node, TerminalNodeImpl):
+                continue
+            order.append((node, brother))
+            children: List[Node] = node.children
+            for i, child in enumerate(children):
+                nodes.append((child, children[i + 1] if i + 1 < len(children) else None))
+
+        # original node -> patched copy
+        patched: Dict[Node, Node] = {}
+        for node, brother in reversed(order):
+            children = node.children
+            if patched and any(child in patched for child in children):
+                children = [patched.get(child, child) for child in children]
+            if patch_required:
+                children = self._patch_field_req(node, children)
+            if patch_sep:
+                children = self._patch_field_list_separator(node, children)
+                children = self._patch_remove_last_list_separator(node, children, brother)
+            if children is node.children:
+                continue
+
+            copied: Node = copy.copy(node)
+            copied.children = children
+            # the new children are linked to the copy, the shared ones stay in the tree
+            shared: Set[int] = {id(child) for child in node.children}
+            for child in children:
+                if id(child) not in shared:
+                    child.parentCtx = copied
+            patched[node] = copied
+        return patched.get(root, root)
 
     @staticmethod
-    def _patch_field_req(node: ParseTree):
-        if not isinstance(node, ThriftParser.FieldContext):
-            return
+    def _patch_field_req(node: Node, children: List[Node]) -> List[Node]:
+        if not isinstance(node, ir.FieldContext):
+            return children
 
         if isinstance(PureThriftFormatter._get_parent(node),
-                      (ThriftParser.Function_Context, ThriftParser.Throws_listContext)):
-            return
+                      (ir.Function_Context, ir.Throws_listContext)):
+            return children
 
-        if not node.children:
-            return
+        if not children:
+            return children
 
         i: int = 0
-        for i, child in enumerate(node.children):
-            if isinstance(child, ThriftParser.Field_reqContext):
-                return
-            if isinstance(child, ThriftParser.Field_typeContext):
+        for i, child in enumerate(children):
+            if isinstance(child, ir.Field_reqContext):
+                return children
+            if isinstance(child, ir.Field_typeContext):
                 break
 
-        fake_token = CommonToken()
-        fake_token.type = FAKE_FIELD_REQ_TYPE
-        fake_token.text = 'required'
-        fake_token.is_fake = True
-        fake_node = TerminalNodeImpl(fake_token)
-        fake_req = ThriftParser.Field_reqContext(parser=node.parser)
-        fake_req.children = [fake_node]
+        fake_req = ir.Field_reqContext()
+        fake_req.children = [TerminalNodeImpl(Token('required', FAKE_FIELD_REQ_TYPE, is_fake=True), fake_req)]
         # patch
-        node.children.insert(i, fake_req)
+        return children[:i] + [fake_req] + children[i:]
 
     @staticmethod
-    def _patch_field_list_separator(node: ParseTree):
-        if not isinstance(node, (ThriftParser.Enum_fieldContext,
-                                 ThriftParser.FieldContext,
-                                 ThriftParser.Function_Context)):
-            return
-
-        tail = node.children[-1]
-        if isinstance(tail, ThriftParser.List_separatorContext):
-            tail.children[0].symbol.text = FAKE_SEP_TOKEN_TEXT
-            return
-
-        fake_token = CommonToken()
-        fake_token.text = FAKE_SEP_TOKEN_TEXT
-        fake_token.is_fake = True
-        fake_node = TerminalNodeImpl(fake_token)
-        fake_ctx = ThriftParser.List_separatorContext(parser=node.parser)
-        fake_ctx.children = [fake_node]
-        node.children.append(fake_ctx)
+    def _patch_field_list_separator(node: Node, children: List[Node]) -> List[Node]:
+        if not isinstance(node, (ir.Enum_fieldContext,
+                                 ir.FieldContext,
+                                 ir.Function_Context)):
+            return children
+
+        tail = children[-1]
+        if isinstance(tail, ir.List_separatorContext):
+            symbol: Token = tail.children[0].symbol
+            if symbol.text == FAKE_SEP_TOKEN_TEXT:
+                return children
+            # the same token with the fake text, its comments are kept
+            sep_ctx = ir.List_separatorContext(start=tail.start, stop=tail.stop)
+            sep_token = Token(FAKE_SEP_TOKEN_TEXT, symbol.type, symbol.channel, symbol.tokenIndex,
+                              symbol.line, symbol.start, symbol.stop)
+            sep_ctx.children = [TerminalNodeImpl(sep_token, sep_ctx)]
+            return children[:-1] + [sep_ctx]
+
+        fake_ctx = ir.List_separatorContext()
+        fake_ctx.children = [TerminalNodeImpl(Token(FAKE_SEP_TOKEN_TEXT, is_fake=True), fake_ctx)]
+        return children + [fake_ctx]
 
     @staticmethod
-    def _patch_remove_last_list_separator(node: ParseTree):
-        is_inline_field = isinstance(node, ThriftParser.FieldContext) and \
+    def _patch_remove_last_list_separator(node: Node, children: List[Node], brother: Optional[Node]) -> List[Node]:
+        is_inline_field = isinstance(node, ir.FieldContext) and \
             isinstance(PureThriftFormatter._get_parent(node),
-                       (ThriftParser.Function_Context, ThriftParser.Throws_listContext))
-        is_inline_node = isinstance(node, ThriftParser.Type_annotationContext)
+                       (ir.Function_Context, ir.Throws_listContext))
+        is_inline_node = isinstance(node, ir.Type_annotationContext)
 
         if is_inline_field or is_inline_node:
-            ThriftFormatter._remove_last_list_separator(node)
+            return ThriftFormatter._remove_last_list_separator(node, children, brother)
+        return children
 
     @staticmethod
-    def _remove_last_list_separator(node: ParseTree):
-        parent = PureThriftFormatter._get_parent(node)
-        if not parent:
-            return
-
-        is_last = False
-        brothers = parent.children
-        for i, child in enumerate(brothers):
-            if child is node and i < len(brothers) - 1:
-                if not isinstance(brothers[i + 1], child.__class__):
-                    is_last = True
-                    break
-
-        if is_last and isinstance(node.children[-1], ThriftParser.List_separatorContext):
-            node.children.pop()
+    def _remove_last_list_separator(node: Node, children: List[Node], brother: Optional[Node]) -> List[Node]:
+        # the node is the last one of its kind, if the next brother is another kind
+        is_last = brother is not None and not isinstance(brother, node.__class__)
+        if is_last and isinstance(children[-1], ir.List_separatorContext):
+            return children[:-1]
+        return children
 
     @staticmethod
-    def _is_field_or_enum_field(node: ParseTree | None):
-        return isinstance(node, (ThriftParser.FieldContext, ThriftParser.Enum_fieldContext))
+    def _is_field_or_enum_field(node: Node | None):
+        return isinstance(node, (ir.FieldContext, ir.Enum_fieldContext))
 
-    @staticmethod
-    def _calc_subblocks_comment_padding(subblocks: List[ParseTree]):
+    def _calc_subblocks_comment_padding(self, subblocks: List[Node]):
         padding: int = 0
         for subblock in subblocks:
-            padding = max(padding, len(PureThriftFormatter().format_node(subblock)))
+            padding = max(padding, self._measure.width(subblock))
 
         if padding > 0:
             return padding + 1
@@ -412,7 +739,7 @@ class ThriftFormatter(PureThriftFormatter):
 
     # align by assign
     @staticmethod
-    def _split_field_by_assign(node: ParseTree):
+    def _split_field_by_assign(node: Node):
         '''
           split field to [left, right] by assgin
           field: '1: required i32 number_a = 0,' -->
@@ -420,14 +747,14 @@ class ThriftFormatter(PureThriftFormatter):
                 right: '= 0,'
         '''
         assert ThriftFormatter._is_field_or_enum_field(node)
-        left: ParseTree = copy.copy(node)
-        right: ParseTree = copy.copy(node)
+        left: Node = copy.copy(node)
+        right: Node = copy.copy(node)
 
         i: int = 0
         current_is_left: bool = True
         for i, child in enumerate(node.children):
             if PureThriftFormatter._is_token(child, '=') or \
-                    isinstance(child, ThriftParser.List_separatorContext):
+                    isinstance(child, ir.List_separatorContext):
                 current_is_left = False
                 break
 
@@ -438,8 +765,7 @@ class ThriftFormatter(PureThriftFormatter):
         right.children = node.children[i:]
         return left, right
 
-    @staticmethod
-    def _calc_field_align_assign_padding(subblocks: List[ParseTree]) -> Tuple[int, int]:
+    def _calc_field_align_assign_padding(self, subblocks: List[Node]) -> Tuple[int, int]:
         '''
             field: '1: required i32 number_a = 0,'
             assign_padding:   max(left) + 1
@@ -452,8 +778,8 @@ class ThriftFormatter(PureThriftFormatter):
         right_max_size: int = 0
         for subblock in subblocks:
             left, right = ThriftFormatter._split_field_by_assign(subblock)
-            left_max_size = max(left_max_size, len(PureThriftFormatter().format_node(left)))
-            right_max_size = max(right_max_size, len(PureThriftFormatter().format_node(right)))
+            left_max_size = max(left_max_size, self._measure.width(left))
+            right_max_size = max(right_max_size, self._measure.width(right))
 
         assign_padding: int = left_max_size + 1  # add an extra space for assgin
         comment_padding: int = assign_padding + right_max_size + 1  # add an extra space for next
@@ -465,17 +791,16 @@ class ThriftFormatter(PureThriftFormatter):
         return assign_padding, comment_padding
 
     @staticmethod
-    def _get_field_child_name(node: ParseTree) -> str:
+    def _get_field_child_name(node: Node) -> str:
         if PureThriftFormatter._is_token(node, '='):
             return '='
         return node.__class__.__name__
 
-    @staticmethod
-    def _calc_field_align_padding_map(subblocks: List[ParseTree]) -> Tuple[Dict[str, int], int]:
+    def _calc_field_align_padding_map(self, subblocks: List[Node]) -> Tuple[Dict[str, int], int]:
         if not subblocks or not ThriftFormatter._is_field_or_enum_field(subblocks[0]):
             return {}, 0
 
-        sep_class = str(ThriftParser.List_separatorContext.__name__)
+        sep_class = str(ir.List_separatorContext.__name__)
         name_levels: Dict[str, int] = {}
         for subblock in subblocks:
             for i in range(len(subblock.children)-1):
@@ -495,7 +820,7 @@ class ThriftFormatter(PureThriftFormatter):
         for subblock in subblocks:
             for child in subblock.children:
                 level = name_levels[ThriftFormatter._get_field_child_name(child)]
-                length = len(PureThriftFormatter().format_node(child))
+                length = self._measure.width(child)
                 level_length[level] = max(level_length.get(level, 0), length)
 
         level_padding: Dict[int, int] = {}
@@ -520,17 +845,10 @@ class ThriftFormatter(PureThriftFormatter):
 
         return padding, comment_padding
 
-    def _get_current_line(self) -> str:
-        if self._newline_c > 0:
-            return ''
-        cur = self._out.getvalue().rsplit('\n', 1)[-1]
-        return cur
-
     def _padding(self, padding: int, pad: str = ' '):
         if padding <= 0:
             return
-        cur = self._get_current_line()
-        padding = padding - len(cur)
+        padding = padding - self._out.column
         if padding > 0:
             self._append(pad * padding)
 
@@ -539,7 +857,7 @@ class ThriftFormatter(PureThriftFormatter):
             return padding + self._option.indent
         return 0
 
-    def _padding_align(self, node: ParseTree):
+    def _padding_align(self, node: Node):
         if not self._is_field_or_enum_field(self._get_parent(node)):
             return
 
@@ -552,7 +870,11 @@ class ThriftFormatter(PureThriftFormatter):
             if self._is_token(node, '='):
                 self._padding(self._field_align_assign_padding, ' ')
 
-    def before_subblocks(self, subblocks: List[ParseTree]):
+    def before_subblocks(self, subblocks: List[Node]):
+        with self._phase('align'):
+            self._calc_subblocks_padding(subblocks)
+
+    def _calc_subblocks_padding(self, subblocks: List[Node]):
         # subblocks : [Function] | [Field] | [Enum_Field]
         if self._option.is_align:
             if self._option.align_field:
@@ -571,34 +893,93 @@ class ThriftFormatter(PureThriftFormatter):
             padding: int = self._calc_subblocks_comment_padding(subblocks)
             self._field_comment_padding: int = self._add_indent_padding(padding)
 
-    def after_subblocks(self, _: List[ParseTree]):
+    def after_subblocks(self, _: List[Node]):
         self._field_align_assign_padding: int = 0
         self._field_comment_padding: int = 0
         self._field_align_padding_map: Dict[str, int] = {}
 
-    def after_block_node(self, _: ParseTree):
-        self._tail_comment()
+    def after_block_node(self, _: Node):
+        with self._phase('comment'):
+            self._tail_comment()
 
-    def before_process_node(self, node: ParseTree):
+    def before_process_node(self, node: Node):
         if self._option.is_align:
             self._padding_align(node)
+        if self._profile is not None:
+            self._profile.count('nodes')
+        for hook in self._before_hooks:
+            hook(node)
+
+    def after_process_node(self, node: Node):
+        for hook in self._after_hooks:
+            hook(node)
+
+    def _process_measured_node(self, node: Node) -> bool:
+        '''
+            emit the text cached by the alignment measurement, if the node
+            has no comment to keep and starts in the middle of a line.
+            the nodes under it are not processed, so the text is not used while
+            a node hook is added or a subclass overrides before_process_node or
+            after_process_node, they see every node as the full walk does.
+        '''
+        if isinstance(node, TerminalNodeImpl) or self._indent_s or self._out.pending_newlines > 0:
+            return False
+        if self._walks_all_nodes():
+            return False
+
+        start: Optional[Token] = getattr(node, 'start', None)
+        stop: Optional[Token] = getattr(node, 'stop', None)
+        if start is None or stop is None or stop.tokenIndex < start.tokenIndex:
+            return False
+
+        text: Optional[str] = self._measure.get(node)
+        if text is None:
+            return False
+
+        if self._option.keep_comment:
+            if self._comments.count(self._last_token_index, stop.tokenIndex + 1):
+                return False
+            self._last_token_index: int = stop.tokenIndex
+
+        if self._profile is not None:
+            self._profile.count('measured_nodes')
+            # the nodes under it are counted as processed
+            self._profile.count('nodes', self._count_nodes(node) - 1)
+        self.before_process_node(node)
+        self._push(text)
+        self.after_process_node(node)
+        return True
+
+    def _walks_all_nodes(self) -> bool:
+        cls = type(self)
+        return bool(self._before_hooks or self._after_hooks) \
+            or cls.before_process_node is not ThriftFormatter.before_process_node \
+            or cls.after_process_node is not ThriftFormatter.after_process_node
+
+    @staticmethod
+    def _count_nodes(root: Node) -> int:
+        count: int = 0
+        nodes: List[Node] = [root]
+        while nodes:
+            node: Node = nodes.pop()
+            count += 1
+            if not isinstance(node, TerminalNodeImpl):
+                nodes.extend(node.children)
+        return count
+
+    def process_node(self, node: Node):
+        if not self._process_measured_node(node):
+            super().process_node(node)
 
     def _line_comments(self, node: TerminalNodeImpl):
         if not self._option.keep_comment:
             return
 
-        if hasattr(node.symbol, 'is_fake') and node.symbol.is_fake:
+        if node.symbol.is_fake:
             return
 
         token_index: int = node.symbol.tokenIndex
-        comments: List[CommonToken] = []
-        for token in self._data.tokens[self._last_token_index + 1:]:
-            if token.channel != 2:
-                continue
-            if self._last_token_index < token.tokenIndex < token_index:
-                comments.append(token)
-
-        for token in comments:
+        for token in self._comments.between(self._last_token_index, token_index):
             if token.tokenIndex > 0 and token.type == ThriftParser.ML_COMMENT:
                 self._newline(2)
 
@@ -623,33 +1004,33 @@ class ThriftFormatter(PureThriftFormatter):
         if self._last_token_index == -1:
             return
 
-        last_token: CommonToken = self._data.tokens[self._last_token_index]
-        comments: List[CommonToken] = []
-        for token in self._data.tokens[self._last_token_index + 1:]:
-            if token.line != last_token.line:
-                break
-            if token.channel != 2:
-                continue
-            comments.append(token)
-
-        assert len(comments) <= 1
-        if comments:
+        comment: Optional[Token] = self._comments.tail(self._last_token_index)
+        if comment:
             if self._field_comment_padding:
                 self._padding(self._field_comment_padding, ' ')
             else:
                 self._append(' ')  # add space
-            self._append(comments[0].text.strip())
+            self._append(comment.text.strip())
+            self._last_token_index: int = comment.tokenIndex
+            # the comments next to it in the line
+            comment = self._comments.tail(comment.tokenIndex)
+            while comment:
+                self._append(' ' + comment.text.strip())
+                self._last_token_index: int = comment.tokenIndex
+                comment = self._comments.tail(comment.tokenIndex)
             self._push('')
-            self._last_token_index: int = comments[0].tokenIndex
 
     def TerminalNodeImpl(self, node: TerminalNodeImpl):
         assert isinstance(node, TerminalNodeImpl)
 
+        start: float = time.perf_counter() if self._profile is not None else 0.0
         # add tail comment before a new line
-        if self._newline_c > 0:
+        if self._out.pending_newlines > 0:
             self._tail_comment()
 
         # add abrove comments
         self._line_comments(node)
+        if self._profile is not None:
+            self._profile.add('comment', time.perf_counter() - start)
 
         super().TerminalNodeImpl(node)
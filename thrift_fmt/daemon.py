@@ -0,0 +1,134 @@
+'''
+a resident formatter listening on a unix socket, which keeps the parser warm.
+
+the protocol is json lines, each request is answered by one response:
+    request:  {"source": "...", "option": {"indent": 4, ...}, "line_range": [start, end] or null}
+    response: {"output": "..."} or {"error": "..."}
+'''
+from __future__ import annotations
+import json
+import os
+import socket
+import socketserver
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+import click
+
+from .option import Option
+
+
+SOCKET_ENV: str = 'THRIFT_FMT_DAEMON_SOCKET'
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_socket_path() -> str:
+    socket_path: Optional[str] = os.environ.get(SOCKET_ENV)
+    if socket_path:
+        return socket_path
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'thrift-fmt-{}.sock'.format(uid))
+
+
+def _handle_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    from .core import ThriftFormatter
+    from .parser import parse
+
+    try:
+        option = Option(**request.get('option', {}))
+        data = parse(request['source'])
+        fmt = ThriftFormatter(data)
+        fmt.option(option)
+        # the definitions not changed since the last request are not formatted again
+        fmt.memo()
+        line_range = request.get('line_range')
+        if line_range:
+            return {'output': fmt.format_range(*line_range)}
+        return {'output': fmt.format()}
+    except Exception as e:
+        return {'error': '{}: {}'.format(e.__class__.__name__, e)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = _handle_request(json.loads(line))
+            except ValueError as e:
+                response = {'error': 'bad request: {}'.format(e)}
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+
+def make_server(socket_path: str) -> socketserver.UnixStreamServer:
+    # the requests are handled one by one, the parser caches are not thread safe
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    return socketserver.UnixStreamServer(socket_path, _RequestHandler)
+
+
+def serve(socket_path: str, state_file: Optional[str] = None):
+    from .dfa_cache import warmup
+
+    # the first request is as fast as the others
+    warmup(state_file)
+    with make_server(socket_path) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+class DaemonClient:
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        self._sock: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(socket_path)
+        except OSError as e:
+            self._sock.close()
+            raise DaemonError('cannot connect to the daemon at {}: {}'.format(socket_path, e))
+        self._rfile = self._sock.makefile('rb')
+
+    def format(self, source: str, option: Option, line_range: Optional[Tuple[int, int]] = None) -> str:
+        request = {'source': source, 'option': vars(option), 'line_range': line_range}
+        self._sock.sendall(json.dumps(request).encode('utf8') + b'\n')
+        line = self._rfile.readline()
+        if not line:
+            raise DaemonError('the daemon closed the connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise DaemonError(response['error'])
+        return response['output']
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+    def __enter__(self) -> DaemonClient:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+@click.command()
+@click.option(
+    '-s', '--socket', 'socket_path', type=click.Path(dir_okay=False), default=None,
+    help='the unix socket to listen  [default: ${} or thrift-fmt-<uid>.sock in the temp dir]'.format(SOCKET_ENV))
+@click.option(
+    '--warmup-state', 'state_file', type=click.Path(dir_okay=False), default=None,
+    help='load the warmed parser caches from the file, or warm them up and save them to it')
+def main(socket_path: Optional[str], state_file: Optional[str]):
+    socket_path = socket_path or get_socket_path()
+    click.echo('thrift-fmt daemon listening on {}'.format(socket_path), err=True)
+    try:
+        serve(socket_path, state_file)
+    except KeyboardInterrupt:
+        pass
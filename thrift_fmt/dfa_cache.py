@@ -0,0 +1,173 @@
+'''
+warm up the prediction caches of the antlr lexer and parser, they are filled
+lazily by the first documents parsed in a process, which makes the first file
+slower than the others. the warmed state can be saved to a file and loaded in
+another process of the same versions.
+
+    import thrift_fmt
+    thrift_fmt.warmup()  # parse a built-in document covering the grammar
+    thrift_fmt.warmup('~/.cache/thrift-fmt/dfa.pickle')  # load it, or warm up and save it
+'''
+from __future__ import annotations
+import io
+import os
+import pickle
+import sys
+from typing import Any, Dict, Optional
+
+from thrift_parser.ThriftLexer import ThriftLexer
+from thrift_parser.ThriftParser import ThriftParser
+
+from .cache import get_version
+from .option import Option
+
+
+STATE_VERSION: str = '1'  # bump it when the layout of the state file changes
+
+# every rule of the grammar but cpp_include (not formatted yet), every token and comment kind
+CORPUS: str = '''\
+/* the built-in document to warm up the parser */
+include "shared.thrift"
+namespace * all.ns
+namespace py warmup.ns // tail
+cpp_namespace warmup
+php_namespace warmup
+
+# a comment
+const i32 INT = +1;
+const i64 HEX = -0x7F,
+const double DOUBLE = -1.5e+3
+const string LITERAL = "a\\"b" ; const string QUOTE = 'it\\'s'
+const list<string> LIST = ["a", 'b'; "c"]
+const map<string, list<i32>> MAP = {"a": [1, 2], "b": []}
+const set<binary> SET = []
+const Other REF = shared.VALUE
+
+typedef i32 MyInt
+typedef list<i32> ( cpp.template = "std::list" ) IntList
+typedef map cpp_type "std::unordered_map" <string, set<byte>> CppMap
+typedef string ( unicode.encoding = "UTF-16" ) NonLatin ( foo = "bar" )
+
+enum Enum {
+    A,
+    B = 2;
+    C = 0x3 ( weekend = "yes" )
+    D
+} ( foo.bar = "baz" )
+
+senum SEnum { "a", "b" }
+
+struct Struct {
+    1: required i16 a = 1, // tail
+    2: optional bool b = true;
+    -3: double c = 1.5 ( presence = "manual", cpp.use_pointer = "" )
+    list<map<string, Struct>> d = [{"k": {}}]
+    5: binary e
+    6: Enum f = Enum.A,
+} ( cpp.type = "DenseFoo", annotation.without.value )
+
+union Union {
+    1: string a
+    2: set<i64> b
+}
+
+exception Error {
+    1: i32 code,
+    2: string message
+} ( foo = "bar" )
+
+service Base {
+    void ping()
+}
+
+service Service extends Base {
+    /* a multi line
+       comment */
+    oneway void fire(1: i32 a, 2: string b) ( priority = "low" ),
+    async void later(),
+    list<Struct> call(1: required Struct s = {}, 2: optional Union u) throws (1: Error e, 2: Error f);
+    map<i32, string> get(
+        1: i32 key,
+    ) ( cpp.name = "get_" )
+} ( foo = "bar" )
+'''
+
+
+def _state() -> Dict[str, Any]:
+    return {
+        'version': STATE_VERSION,
+        'antlr4': get_version('antlr4-python3-runtime', 'antlr4'),
+        'thrift-parser': get_version('thrift-parser', 'thrift_parser'),
+        'python': sys.version_info[:2],
+    }
+
+
+def warm_caches():
+    '''
+        parse and format the built-in document, with the antlr lexer too,
+        which lexes any document the regex lexer can not
+    '''
+    from .core import ThriftFormatter
+    from .parser import parse
+
+    parse(CORPUS, strict=True, regex_lexer=False)
+    data = parse(CORPUS, strict=True, sll=False)
+    for option in (Option(), Option(align_field=True, keep_comment=False)):
+        fmt = ThriftFormatter(data)
+        fmt.option(option)
+        fmt.format()
+
+
+def save_state(path: str):
+    '''
+        save the prediction caches of this process to a file, with the atns they
+        refer to, written to a temporary file and renamed like the format cache
+    '''
+    state: Dict[str, Any] = _state()
+    state['caches'] = (
+        ThriftLexer.atn, ThriftLexer.decisionsToDFA,
+        ThriftParser.atn, ThriftParser.decisionsToDFA, ThriftParser.sharedContextCache,
+    )
+    path = os.path.expanduser(path)
+    directory: str = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp: str = '{}.{}.tmp'.format(path, os.getpid())
+    with io.open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_state(path: str) -> bool:
+    '''
+        replace the prediction caches by the ones saved by `save_state`, return
+        False if the file is missing, broken or saved by other versions.
+        the file is unpickled, so only load a file written by yourself.
+    '''
+    try:
+        with io.open(os.path.expanduser(path), 'rb') as f:
+            state: Dict[str, Any] = pickle.load(f)
+    except Exception:
+        return False
+    current: Dict[str, Any] = _state()
+    # the atns of unknown versions may not match the runtime
+    if 'unknown' in current.values():
+        return False
+    if not isinstance(state, dict) or any(state.get(key) != value for key, value in current.items()):
+        return False
+
+    (ThriftLexer.atn, ThriftLexer.decisionsToDFA,
+     ThriftParser.atn, ThriftParser.decisionsToDFA, ThriftParser.sharedContextCache) = state['caches']
+    return True
+
+
+def warmup(state_file: Optional[str] = None):
+    '''
+        warm up the prediction caches, so the first document of the process is
+        as fast as the others. if state_file is given, the state is loaded from
+        it, or it is warmed up and saved to it for the next processes.
+    '''
+    if state_file and load_state(state_file):
+        return
+    warm_caches()
+    if state_file:
+        save_state(state_file)
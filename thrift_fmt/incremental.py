@@ -0,0 +1,218 @@
+'''
+reformat new versions of a document incrementally, only the changed top level
+definitions are parsed and formatted again.
+'''
+from __future__ import annotations
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from thrift_parser import ThriftData
+from thrift_parser.ThriftParser import ThriftParser
+
+from . import ir
+from .core import ThriftFormatter, PureThriftFormatter, OutputWriter
+from .ir import Node
+from .option import Option
+from .parser import parse, ThriftSyntaxError
+
+
+class Chunk:
+    '''
+        a slice of the source with some top level nodes and their comments,
+        and the output of them. a deprecated senum outputs nothing, so it is
+        kept with the next node, the last chunk of a document is the EOF.
+    '''
+    __slots__ = ('text', 'output', 'first_class', 'last_class', 'newline_first', 'ml_comment_first')
+
+    def __init__(self, text: str, output: str, nodes: List[Node], ml_comment_first: bool):
+        self.text: str = text
+        self.output: str = output
+        first: Node = Chunk._unwrap(nodes[0])
+        self.first_class: type = first.__class__
+        self.last_class: type = Chunk._unwrap(nodes[-1]).__class__
+        self.newline_first: bool = PureThriftFormatter._is_newline_node(first)
+        self.ml_comment_first: bool = ml_comment_first
+
+    @staticmethod
+    def _unwrap(node: Node) -> Node:
+        if isinstance(node, (ir.HeaderContext, ir.DefinitionContext)):
+            return node.children[0]
+        return node
+
+
+ChunkSpan = Tuple[int, int, List[Node], int]
+
+
+def chunk_spans(fmt: ThriftFormatter) -> List[ChunkSpan]:
+    '''
+        split the document of a formatter to chunks, return (start, end, nodes,
+        the last token index before the nodes) for each one, the text of a
+        chunk is source[start:end].
+    '''
+    source: str = fmt._source
+
+    spans: List[ChunkSpan] = []
+    pos: int = 0
+    nodes: List[Node] = []
+    first_index: int = -1  # the last token before the nodes
+    last_index: int = -1  # the last token of the chunks
+    for node, first, last, last_token_index in fmt._definition_segments():
+        if not nodes:
+            first_index = last_token_index
+        nodes.append(node)
+        if isinstance(Chunk._unwrap(node), ir.SenumContext):
+            continue
+
+        end: int = last.stop + 1
+        spans.append((pos, end, nodes, first_index))
+        pos = end
+        last_index = last.tokenIndex
+        nodes = []
+
+    # the EOF with the comments before it
+    if not nodes:
+        first_index = last_index
+    nodes.append(fmt._document.children[-1])
+    spans.append((pos, len(source), nodes, first_index))
+    return spans
+
+
+def split_chunks(data: ThriftData, option: Option) -> List[Chunk]:
+    '''
+        split a parsed document to chunks, and format each one in the document
+    '''
+    fmt = ThriftFormatter(data)
+    fmt.option(option)
+    return [format_chunk(fmt, span) for span in chunk_spans(fmt)]
+
+
+def format_chunk(fmt: ThriftFormatter, span: ChunkSpan) -> Chunk:
+    '''
+        format the nodes of a span in the document of the formatter
+    '''
+    start, end, nodes, first_index = span
+    output: str = fmt._format_definitions(nodes, first_index)
+    return Chunk(fmt._source[start:end], output, nodes, _is_ml_comment_first(fmt, first_index, nodes[0]))
+
+
+def _is_ml_comment_first(fmt: ThriftFormatter, last_index: int, node: Node) -> bool:
+    # a multi line comment wants an empty line before it
+    if not fmt._option.keep_comment:
+        return False
+    start = node.symbol if ThriftFormatter._is_EOF(node) else node.start
+    comments = fmt._comments.between(last_index, start.tokenIndex)
+    return bool(comments) and comments[0].type == ThriftParser.ML_COMMENT
+
+
+def join_chunks(chunks: List[Chunk]) -> str:
+    '''
+        join the output of chunks, with the newlines between the top level nodes
+        the same as `PureThriftFormatter._block_nodes`
+    '''
+    return ''.join(iter_join_chunks(chunks))
+
+
+def iter_join_chunks(chunks: Iterable[Chunk]) -> Iterator[str]:
+    '''
+        like join_chunks, yield the text of each chunk once joined
+    '''
+    out = OutputWriter()
+    last_class: Optional[type] = None
+    for i, chunk in enumerate(chunks):
+        output: str = chunk.output
+        if i > 0:
+            if chunk.first_class is not last_class or chunk.newline_first or chunk.ml_comment_first:
+                out.newline(2)
+            else:
+                out.newline()
+            stripped: str = output.lstrip('\n')
+            out.newline(len(output) - len(stripped))
+            output = stripped
+        if output:
+            out.push(output)
+            yield out.take()
+        last_class = chunk.last_class
+
+
+class IncrementalSession:
+    '''
+        keep the last document split by the top level definitions, to format a
+        new version of the text, only the changed definitions are parsed again
+        and the output of the other ones is reused.
+
+        session = IncrementalSession(Option())
+        out = session.format(text)
+        out = session.format(edited_text)
+    '''
+
+    def __init__(self, option: Optional[Option] = None):
+        self._option: Option = option or Option()
+        self._source: Optional[str] = None
+        self._chunks: List[Chunk] = []
+        self._output: str = ''
+        # the count of the chunks formatted by the last `format`
+        self.formatted_chunks: int = 0
+
+    def format(self, source: str) -> str:
+        if self._source is None or not self._update(source):
+            self._chunks = split_chunks(parse(source), self._option)
+            self.formatted_chunks = len(self._chunks)
+        elif source == self._source:
+            self.formatted_chunks = 0
+            return self._output
+
+        self._source = source
+        self._output = join_chunks(self._chunks)
+        return self._output
+
+    def _update(self, source: str) -> bool:
+        '''
+            parse the changed chunks again, return False if the whole source
+            should be parsed again
+        '''
+        chunks: List[Chunk] = self._chunks
+
+        # skip the same chunks in the head and the tail
+        i0, start = 0, 0
+        while i0 < len(chunks) and source.startswith(chunks[i0].text, start):
+            start += len(chunks[i0].text)
+            i0 += 1
+        if i0 == len(chunks):
+            if start == len(source):
+                return True
+            i0 -= 1
+            start -= len(chunks[i0].text)
+
+        i1, end = len(chunks) - 1, len(source)
+        while i1 > i0 and source.endswith(chunks[i1].text, start, end):
+            end -= len(chunks[i1].text)
+            i1 -= 1
+
+        while True:
+            # a comment in the same line may be the tail comment of the previous node
+            if i0 > 0 and not chunks[i0 - 1].text.endswith('\n') and source[start:end].split('\n', 1)[0].strip():
+                i0 -= 1
+                start -= len(chunks[i0].text)
+                continue
+            if i1 < len(chunks) - 1 and not source[start:end].endswith('\n') \
+                    and chunks[i1 + 1].text.split('\n', 1)[0].strip():
+                end += len(chunks[i1 + 1].text)
+                i1 += 1
+                continue
+
+            try:
+                changed: List[Chunk] = split_chunks(parse(source[start:end], strict=True), self._option)
+            except ThriftSyntaxError:
+                return False
+
+            # the text after the last node belongs to the next chunk, parse it together
+            if i1 < len(chunks) - 1:
+                if changed[-1].text:
+                    end += len(chunks[i1 + 1].text)
+                    i1 += 1
+                    continue
+                changed.pop()
+            break
+
+        self._chunks = chunks[:i0] + changed + chunks[i1 + 1:]
+        self.formatted_chunks = len(changed)
+        return True
@@ -0,0 +1,204 @@
+'''
+a compact tree of a thrift document for the formatter, converted from the antlr
+parse tree. the nodes and tokens are `__slots__` objects keeping only what the
+formatter reads, so the antlr tree and token stream can be freed once converted.
+
+a rule node class has the same name as its antlr context, as `Struct_Context`,
+so the formatter handlers are looked up by the same names.
+'''
+from __future__ import annotations
+import gc
+import sys
+from typing import Dict, List, Optional, Tuple, Union
+
+from antlr4.Token import CommonToken
+from antlr4.tree.Tree import ParseTree
+from antlr4.tree import Tree
+
+from thrift_parser import ThriftData
+from thrift_parser.ThriftParser import ThriftParser
+
+
+WS_CHANNEL: int = 1  # white spaces are sent to channel 1 by the thrift lexer
+COMMENT_CHANNEL: int = 2  # comments are sent to channel 2 by the thrift lexer
+
+
+class Token:
+    __slots__ = ('text', 'type', 'channel', 'tokenIndex', 'line', 'start', 'stop', 'is_fake')
+
+    def __init__(self, text: str, type: int = 0, channel: int = 0, tokenIndex: int = -1,
+                 line: int = 0, start: int = -1, stop: int = -1, is_fake: bool = False):
+        self.text: str = text
+        self.type: int = type
+        self.channel: int = channel
+        self.tokenIndex: int = tokenIndex
+        self.line: int = line
+        self.start: int = start
+        self.stop: int = stop
+        self.is_fake: bool = is_fake
+
+    @staticmethod
+    def from_antlr(token: CommonToken) -> Token:
+        text: str = token.text
+        # the keywords and names repeat a lot, the comments seldom do
+        if token.channel != COMMENT_CHANNEL:
+            text = sys.intern(text)
+        return Token(text, token.type, token.channel, token.tokenIndex, token.line, token.start, token.stop)
+
+
+class Node:
+    # parent is set by `PureThriftFormatter.walk_node`
+    __slots__ = ('parentCtx', 'parent')
+
+    def __init__(self, parent: Optional[Node] = None):
+        self.parentCtx: Optional[Node] = parent
+
+
+class TerminalNodeImpl(Node):
+    __slots__ = ('symbol',)
+
+    def __init__(self, symbol: Token, parent: Optional[Node] = None):
+        self.parentCtx: Optional[Node] = parent
+        self.symbol: Token = symbol
+
+
+class Rule(Node):
+    __slots__ = ('children', 'start', 'stop')
+
+    def __init__(self, parent: Optional[Node] = None, children: Optional[List[Node]] = None,
+                 start: Optional[Token] = None, stop: Optional[Token] = None):
+        self.parentCtx: Optional[Node] = parent
+        self.children: List[Node] = children if children is not None else []
+        self.start: Optional[Token] = start
+        self.stop: Optional[Token] = stop
+
+
+def _rule_class_name(rule: str) -> str:
+    # the same as the antlr python target, `struct_` -> `Struct_Context`
+    return rule[0].upper() + rule[1:] + 'Context'
+
+
+# rule class name -> rule class, one for each thrift grammar rule
+RULE_CLASSES: Dict[str, type] = {
+    _rule_class_name(rule): type(_rule_class_name(rule), (Rule,), {'__slots__': (), '__module__': __name__})
+    for rule in ThriftParser.ruleNames
+}
+globals().update(RULE_CLASSES)
+
+_ANTLR_RULE_CLASSES: Dict[type, type] = {
+    getattr(ThriftParser, name): cls for name, cls in RULE_CLASSES.items()
+}
+
+
+class CommentIndex:
+    '''
+        index the comment tokens of a document once, so the formatter can
+        find the comments around a token without rescanning the token stream
+    '''
+
+    def __init__(self, tokens: List[Token]):
+        self._comments: List[Token] = []
+        # _before[i] is the count of comments whose tokenIndex < i
+        self._before: List[int] = [0] * (len(tokens) + 1)
+        # _tail[i] is the comment after token i and the white spaces in the same line,
+        # the tails of a comment chain the comments next to each other
+        self._tail: List[Optional[Token]] = [None] * len(tokens)
+
+        for i, token in enumerate(tokens):
+            self._before[i] = len(self._comments)
+            if token.channel == COMMENT_CHANNEL:
+                self._comments.append(token)
+        self._before[len(tokens)] = len(self._comments)
+
+        for i in range(len(tokens) - 2, -1, -1):
+            follow = tokens[i + 1]
+            if follow.line != tokens[i].line:
+                continue
+            # only white spaces between, a comment after the next tokens is theirs
+            if follow.channel == COMMENT_CHANNEL:
+                self._tail[i] = follow
+            elif follow.channel == WS_CHANNEL:
+                self._tail[i] = self._tail[i + 1]
+
+    def between(self, start: int, end: int) -> List[Token]:
+        '''
+            comments with start < tokenIndex < end
+        '''
+        if end <= start + 1:
+            return []
+        return self._comments[self._before[start + 1]:self._before[end]]
+
+    def count(self, start: int, end: int) -> int:
+        '''
+            count of comments with start < tokenIndex < end
+        '''
+        if end <= start + 1:
+            return 0
+        return self._before[end] - self._before[start + 1]
+
+    def tail(self, index: int) -> Optional[Token]:
+        '''
+            the comment after token `index` and the white spaces in the same line
+        '''
+        return self._tail[index]
+
+
+def convert_node(root: Union[ParseTree, Node], tokens: Optional[List[Token]] = None) -> Node:
+    '''
+        convert an antlr subtree, the tokens of the tree are taken from `tokens`
+        by the token index if given, so they are shared with the comment index.
+    '''
+    if isinstance(root, Node):
+        return root
+
+    def convert_token(token: Optional[CommonToken]) -> Optional[Token]:
+        if token is None:
+            return None
+        if tokens is not None and 0 <= token.tokenIndex < len(tokens):
+            return tokens[token.tokenIndex]
+        return Token.from_antlr(token)
+
+    def new_node(node: ParseTree, parent: Optional[Node]) -> Node:
+        if isinstance(node, Tree.TerminalNodeImpl):
+            return TerminalNodeImpl(convert_token(node.symbol), parent)
+        return _ANTLR_RULE_CLASSES[node.__class__](parent, None, convert_token(node.start), convert_token(node.stop))
+
+    ir_root: Node = new_node(root, None)
+    # not recursive, a deep const value never reaches the recursion limit
+    nodes: List[Tuple[ParseTree, Node]] = [(root, ir_root)]
+    while nodes:
+        node, ir_node = nodes.pop()
+        if isinstance(ir_node, Rule) and node.children:
+            for child in node.children:
+                ir_child: Node = new_node(child, ir_node)
+                ir_node.children.append(ir_child)
+                nodes.append((child, ir_child))
+    return ir_root
+
+
+class Document:
+    '''
+        the converted document with its comments and source text
+    '''
+    __slots__ = ('root', 'comments', 'source', 'token_count')
+
+    def __init__(self, root: Node, comments: CommentIndex, source: str, token_count: int):
+        self.root: Node = root
+        self.comments: CommentIndex = comments
+        self.source: str = source
+        self.token_count: int = token_count
+
+    @staticmethod
+    def from_data(data: ThriftData) -> Document:
+        # the conversion only allocates, a collection in the middle would walk both trees for nothing
+        gc_enabled: bool = gc.isenabled()
+        gc.disable()
+        try:
+            # the white spaces are only read while indexing the comments, they are not converted
+            tokens: List[Union[Token, CommonToken]] = [
+                token if token.channel == WS_CHANNEL else Token.from_antlr(token) for token in data.tokens]
+            source: str = data.tokens[-1].getInputStream().strdata
+            return Document(convert_node(data.document, tokens), CommentIndex(tokens), source, len(tokens))
+        finally:
+            if gc_enabled:
+                gc.enable()
@@ -0,0 +1,124 @@
+'''
+a lexer of compiled regular expressions producing the same tokens as the antlr
+`ThriftLexer`: the types, channels, positions, lines and columns are the same,
+the parser is fed by a `ListTokenSource`. the antlr lexer runs a state machine
+char by char in python, this one is several times faster.
+
+a source with any text the grammar can not lex is left to the antlr lexer, so
+its errors are reported exactly as before.
+'''
+from __future__ import annotations
+import re
+from typing import Dict, List, Optional, Tuple
+
+from antlr4 import InputStream, Token
+from antlr4.Lexer import TokenSource
+from antlr4.ListTokenSource import ListTokenSource
+from antlr4.Token import CommonToken
+
+from thrift_parser.ThriftLexer import ThriftLexer
+
+
+WS_CHANNEL: int = 1  # white spaces are sent to channel 1 by the thrift lexer
+COMMENT_CHANNEL: int = 2  # comments are sent to channel 2 by the thrift lexer
+
+# the keywords and the punctuations, the literal rules are matched before IDENTIFIER
+LITERAL_TYPES: Dict[str, int] = {
+    name[1:-1]: i for i, name in enumerate(ThriftLexer.literalNames[:ThriftLexer.INTEGER]) if name.startswith("'")
+}
+LITERAL_TYPES.update({
+    'bool': ThriftLexer.TYPE_BOOL,
+    'byte': ThriftLexer.TYPE_BYTE,
+    'i16': ThriftLexer.TYPE_I16,
+    'i32': ThriftLexer.TYPE_I32,
+    'i64': ThriftLexer.TYPE_I64,
+    'double': ThriftLexer.TYPE_DOUBLE,
+    'string': ThriftLexer.TYPE_STRING,
+    'binary': ThriftLexer.TYPE_BINARY,
+    ',': ThriftLexer.COMMA,
+})
+
+# each alternative is the longest match of the rules starting with its first
+# chars, as the maximal munch of antlr. a number is a DOUBLE unless it is an
+# INTEGER too (the rule defined first), the same for a word and the keywords
+_TOKEN = re.compile(r'''
+    (?P<ws>(?:[ \t\n]|\r\n)+)
+    |(?P<sl_comment>(?://|\#)[^\n]*\n)
+    |(?P<ml_comment>/\*.*?\*/)
+    |(?P<literal>"(?:\\["'\\nrt]|[^\\"])*"|'(?:\\["'\\nrt]|[^\\'])*')
+    |(?P<hex>-?0x[0-9A-Fa-f]+)
+    |(?P<number>[+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+)(?:[Ee][+-]?[0-9]+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9._]*)
+    |(?P<punct>[*={}:()<>\[\];,])
+''', re.VERBOSE | re.DOTALL)
+_INTEGER = re.compile(r'[+-]?[0-9]+')
+
+# group -> (type, channel) of the groups with a single token type
+_GROUP_TYPES: Dict[str, Tuple[int, int]] = {
+    'ws': (ThriftLexer.WS, WS_CHANNEL),
+    'sl_comment': (ThriftLexer.SL_COMMENT, COMMENT_CHANNEL),
+    'ml_comment': (ThriftLexer.ML_COMMENT, COMMENT_CHANNEL),
+    'literal': (ThriftLexer.LITERAL, Token.DEFAULT_CHANNEL),
+    'hex': (ThriftLexer.HEX_INTEGER, Token.DEFAULT_CHANNEL),
+}
+
+
+def _new_token(source: Tuple[TokenSource, InputStream], token_type: int, channel: int, start: int, stop: int,
+               text: Optional[str], line: int, column: int, token_index: int) -> CommonToken:
+    # all the fields are known, skip the __init__ reading the line and column of the token source
+    token: CommonToken = CommonToken.__new__(CommonToken)
+    token.source = source
+    token.type = token_type
+    token.channel = channel
+    token.start = start
+    token.stop = stop
+    token._text = text
+    token.line = line
+    token.column = column
+    token.tokenIndex = token_index
+    return token
+
+
+def tokenize(source: str) -> Optional[List[CommonToken]]:
+    '''
+        the tokens of the source with the EOF, the same as the antlr lexer with
+        a `CommonTokenStream` filled. return None if any text can not be lexed
+    '''
+    input_stream = InputStream(source)
+    token_source = ListTokenSource([])
+    pair = (token_source, input_stream)
+
+    tokens: List[CommonToken] = token_source.tokens
+    line: int = 1
+    line_start: int = 0  # the position of the first char of the line
+    pos: int = 0
+    for m in _TOKEN.finditer(source):
+        if m.start() != pos:
+            return None
+        kind: str = m.lastgroup
+        text: str = m.group()
+        end: int = m.end()
+
+        if kind in _GROUP_TYPES:
+            token_type, channel = _GROUP_TYPES[kind]
+        elif kind == 'number':
+            token_type = ThriftLexer.INTEGER if _INTEGER.fullmatch(text) else ThriftLexer.DOUBLE
+            channel = Token.DEFAULT_CHANNEL
+        else:
+            token_type = LITERAL_TYPES.get(text, ThriftLexer.IDENTIFIER)
+            channel = Token.DEFAULT_CHANNEL
+        tokens.append(_new_token(pair, token_type, channel, pos, end - 1, text, line, pos - line_start, len(tokens)))
+
+        if kind in _GROUP_TYPES:
+            newline: int = text.rfind('\n')
+            if newline >= 0:
+                line += text.count('\n')
+                line_start = pos + newline + 1
+        pos = end
+    if pos != len(source):
+        return None
+
+    # the same as `Lexer.emitEOF`, its text is '<EOF>'
+    tokens.append(_new_token(pair, Token.EOF, Token.DEFAULT_CHANNEL, pos, pos - 1, None, line, pos - line_start,
+                             len(tokens)))
+    return tokens
@@ -1,10 +1,200 @@
+from __future__ import annotations
+import contextlib
 import io
+import itertools
+import json
+import os
 import pathlib
-from typing import Optional, List
+import sys
+import typing
+from typing import Optional, List, Iterable, Iterator, Tuple, Dict, TextIO, Union
 
 import click
 
-from .core import ThriftData, ThriftFormatter, Option
+from .option import Option
+
+# only the light modules are imported at startup, the others are imported on use
+if typing.TYPE_CHECKING:
+    from .cache import Cache
+    from .core import FormatProfile
+    from .daemon import DaemonClient
+
+
+# (output, changed, error), the changed of a streamed output is known once it is written
+FormatResult = Tuple[Union[str, 'StreamedOutput', None], bool, Optional[str]]
+# (start_line, end_line)
+LineRange = Optional[Tuple[int, int]]
+
+
+def _read_file(file: pathlib.Path) -> str:
+    # keep the origin newlines, the same as antlr4's FileStream
+    with io.open(file, 'r', encoding='utf8', newline='') as f:
+        return f.read()
+
+
+def _format_error(e: Exception) -> FormatResult:
+    return None, False, '{}: {}'.format(e.__class__.__name__, e)
+
+
+def _format_source(source: str, option: Option, line_range: LineRange = None,
+                   profile: Optional[FormatProfile] = None) -> FormatResult:
+    # run in the worker process, the error is returned instead of raised.
+    # the parser is imported here, so `--help` and bad arguments stay fast
+    from .core import ThriftFormatter
+    from .parser import parse
+
+    try:
+        with profile.phase('parse') if profile else contextlib.nullcontext():
+            data = parse(source)
+        fmt = ThriftFormatter(data)
+        fmt.option(option)
+        if profile:
+            fmt.profile(profile)
+        else:
+            fmt.memo()
+        if line_range:
+            output: str = fmt.format_range(*line_range)
+        else:
+            output = fmt.format()
+        return output, output != source, None
+    except Exception as e:
+        return _format_error(e)
+
+
+class StreamedOutput:
+    '''
+        the output of a file formatted in this process, it is written by the top
+        level definitions as soon as they are formatted, so the whole output of a
+        huge file is never held for the stdout and --check. it is compared with the
+        source on the way.
+    '''
+
+    def __init__(self, source: str, chunks: Iterator[str], cache: Optional[Cache]):
+        self._source: str = source
+        self._chunks: Iterator[str] = chunks
+        self._cache: Optional[Cache] = cache
+
+    def write(self, stream: Optional[TextIO]) -> bool:
+        '''
+            write the output to the stream if given, return whether it is changed
+        '''
+        pos: int = 0
+        changed: bool = False
+        for text in self._chunks:
+            if not changed:
+                if self._source.startswith(text, pos):
+                    pos += len(text)
+                else:
+                    changed = True
+            if stream is not None:
+                stream.write(text)
+        changed = changed or pos != len(self._source)
+        if self._cache and not changed:
+            self._cache.add(self._source)
+        return changed
+
+
+def _stream_source(source: str, option: Option, jobs: int = 1, cache: Optional[Cache] = None) -> FormatResult:
+    # the source is parsed here, the errors while formatting are raised by `StreamedOutput.write`
+    from .core import ThriftFormatter
+    from .parser import parse
+
+    try:
+        if jobs > 1:
+            # split by the scanner, the whole source is not parsed
+            from .parallel import iter_format_parallel
+            chunks: Iterator[str] = iter_format_parallel(source, option, jobs)
+        else:
+            fmt = ThriftFormatter(parse(source))
+            fmt.option(option)
+            fmt.memo()
+            chunks = fmt.iter_format()
+        return StreamedOutput(source, chunks, cache), False, None
+    except Exception as e:
+        return _format_error(e)
+
+
+def _format_remote(client: DaemonClient, source: str, option: Option,
+                   line_range: LineRange = None) -> FormatResult:
+    from .daemon import DaemonError
+
+    try:
+        output: str = client.format(source, option, line_range)
+        return output, output != source, None
+    except DaemonError as e:
+        return _format_error(e)
+
+
+def _iter_results(files: List[pathlib.Path], option: Option, jobs: int, cache: Optional[Cache],
+                  client: Optional[DaemonClient] = None, line_range: LineRange = None,
+                  profiles: Optional[Dict[str, FormatProfile]] = None) -> Iterator[FormatResult]:
+    '''
+        yield the result of each file in order, the files known formatted by
+        the cache are not parsed, the others are formatted by the daemon client
+        if given, or by `jobs` processes. if profiles is given, the files are
+        formatted one by one in this process, with the profile of each file.
+    '''
+    known: Dict[int, FormatResult] = {}
+    sources: List[str] = []
+    source_files: List[pathlib.Path] = []
+    for i, file in enumerate(files):
+        try:
+            source: str = _read_file(file)
+        except Exception as e:
+            known[i] = _format_error(e)
+            continue
+
+        if cache and cache.is_formatted(source):
+            known[i] = (source, False, None)
+        else:
+            sources.append(source)
+            source_files.append(file)
+
+    # a single large file is split at its top level definitions for the processes
+    file_jobs: int = jobs if len(sources) == 1 else 1
+    jobs = min(jobs, len(sources))
+    if profiles is not None:
+        from .core import FormatProfile
+        file_profiles = [profiles.setdefault(str(file), FormatProfile()) for file in source_files]
+        results = map(_format_source, sources, itertools.repeat(option), itertools.repeat(line_range),
+                      file_profiles)
+        yield from _merge_results(len(files), known, sources, results, cache)
+    elif client:
+        results = map(_format_remote, itertools.repeat(client), sources, itertools.repeat(option),
+                      itertools.repeat(line_range))
+        yield from _merge_results(len(files), known, sources, results, cache)
+    elif jobs > 1:
+        chunksize: int = max(1, len(sources) // (jobs * 4))
+        from concurrent.futures import ProcessPoolExecutor
+        from .dfa_cache import warmup
+        with ProcessPoolExecutor(max_workers=jobs, initializer=warmup) as executor:
+            results = executor.map(_format_source, sources, itertools.repeat(option),
+                                   itertools.repeat(line_range), chunksize=chunksize)
+            yield from _merge_results(len(files), known, sources, results, cache)
+    elif line_range:
+        results = map(_format_source, sources, itertools.repeat(option), itertools.repeat(line_range))
+        yield from _merge_results(len(files), known, sources, results, cache)
+    else:
+        # formatted in this process, the output is written through as it is formatted
+        results = map(_stream_source, sources, itertools.repeat(option), itertools.repeat(file_jobs),
+                      itertools.repeat(cache))
+        yield from _merge_results(len(files), known, sources, results, cache)
+
+
+def _merge_results(count: int, known: Dict[int, FormatResult], sources: List[str],
+                   results: Iterator[FormatResult], cache: Optional[Cache]) -> Iterator[FormatResult]:
+    formatted = zip(sources, results)
+    for i in range(count):
+        if i in known:
+            yield known[i]
+            continue
+
+        source, result = next(formatted)
+        output, changed, error = result
+        # a streamed output adds itself to the cache once written
+        if cache and error is None and not changed and not isinstance(output, StreamedOutput):
+            cache.add(source)
+        yield result
 
 
 @click.command()
@@ -26,33 +216,50 @@ from .core import ThriftData, ThriftFormatter, Option
 @click.option(
     '--no-align', is_flag=True, default=False, help='disable all --align-xx flag')
 @click.option(
-    '-r', '--recursive', is_flag=True, default=False, help='If `path` is dir, will recursive format all thrift files')
+    '-r', '--recursive', is_flag=True, default=False, help='If a path is dir, will recursive format all thrift files')
 @click.option(
     '-w', '--write', is_flag=True,
-    help='If `path` is file, will write to file instead of stdout. default true when `path` is a dir')
+    help='If a path is file, will write to file instead of stdout. default true for the files in a dir')
+@click.option(
+    '--check', is_flag=True, default=False,
+    help='do not write files, list the files would be reformatted and exit with 1 if any')
+@click.option(
+    '-j', '--jobs', type=click.IntRange(min=1), default=None,
+    help='format files in parallel with this many processes  [default: number of CPUs]')
+@click.option(
+    '--no-cache', is_flag=True, default=False,
+    help='do not skip the files known formatted by the cache (in $THRIFT_FMT_CACHE_DIR or ~/.cache/thrift-fmt)')
+@click.option(
+    '--daemon-socket', type=click.Path(dir_okay=False), default=None,
+    help='send the files to the daemon (started by `thrift-fmt-daemon`) listening on this socket')
+@click.option(
+    '--line-range', type=(click.IntRange(min=1), click.IntRange(min=1)), default=None,
+    help='only format the top level definitions overlap the lines START END (1-based) of a single file')
+@click.option(
+    '--profile', 'profile_path', type=click.Path(dir_okay=False, writable=True), default=None,
+    help='format the files one by one without the cache, write the phase timers and counters of each file as json')
+@click.option(
+    '--cprofile', 'cprofile_path', type=click.Path(dir_okay=False, writable=True), default=None,
+    help='with --profile, also run cProfile and dump the pstats to this file')
 @click.argument(
-    'path',
+    'paths', nargs=-1,
     type=click.Path(exists=True, file_okay=True, dir_okay=True), required=True)
 def main(indent: Optional[int], remove_comment: Optional[bool],
          patch_required: Optional[bool], patch_sep: Optional[bool],
          align_field: Optional[bool], align_assign: Optional[bool],
          no_patch: Optional[bool], no_align: Optional[bool],
-         recursive: Optional[bool], write: Optional[bool],
-         path: str):
+         recursive: Optional[bool], write: Optional[bool], check: Optional[bool],
+         jobs: Optional[int], no_cache: Optional[bool], daemon_socket: Optional[str],
+         line_range: LineRange, profile_path: Optional[str], cprofile_path: Optional[str],
+         paths: Tuple[str, ...]):
 
-    files: List[str] = []
-
-    p = pathlib.Path(path)
-    if p.is_file():
-        files = [p]
-    elif p.is_dir():
-        if recursive:
-            files = p.glob('**/*.thrift')
-        else:
-            files = p.glob('*.thrift')
-        write = True
-    else:
-        raise click.ClickException('path must be file or dir')
+    files, writes = _collect_files(paths, recursive, write)
+    if line_range and len(files) != 1:
+        raise click.ClickException('--line-range needs exactly one file')
+    if cprofile_path and not profile_path:
+        raise click.ClickException('--cprofile needs --profile')
+    if profile_path and daemon_socket:
+        raise click.ClickException('--profile cannot be used with --daemon-socket')
 
     option = Option(
         patch_sep=patch_sep,
@@ -67,14 +274,139 @@ def main(indent: Optional[int], remove_comment: Optional[bool],
     if no_align:
         option.disble_align()
 
-    for file in files:
-        data = ThriftData.from_file(file)
-        fmt = ThriftFormatter(data)
-        fmt.option(option)
-        output = fmt.format()
+    cache: Optional[Cache] = None
+    # the cache only knows the files formatted as a whole
+    if not no_cache and not line_range and not profile_path:
+        from .cache import Cache
+        cache = Cache(option)
+
+    client: Optional[DaemonClient] = None
+    if daemon_socket:
+        from .daemon import DaemonClient, DaemonError
+        try:
+            client = DaemonClient(daemon_socket)
+        except DaemonError as e:
+            raise click.ClickException(str(e))
 
-        if write:
-            with io.open(file, 'w', encoding='utf8') as f:
-                f.write(output)
+    profiles: Optional[Dict[str, FormatProfile]] = {} if profile_path else None
+    profiler = None
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        results = _iter_results(files, option, jobs or os.cpu_count() or 1, cache, client, line_range, profiles)
+        changed, errors = _output_results(files, results, writes, check, line_range)
+    finally:
+        if client:
+            client.close()
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+    if cache:
+        cache.save()
+    if profile_path:
+        with io.open(profile_path, 'w', encoding='utf8') as f:
+            json.dump({file: profile.to_dict() for file, profile in profiles.items()}, f, indent=2)
+            f.write('\n')
+
+    if errors:
+        for error in errors:
+            click.echo(error, err=True)
+        raise click.ClickException('failed to format {} file(s)'.format(len(errors)))
+
+    if check and changed:
+        click.echo('{} file(s) would be reformatted'.format(len(changed)), err=True)
+        raise SystemExit(1)
+
+
+def _collect_files(paths: Iterable[str], recursive: Optional[bool],
+                   write: Optional[bool]) -> Tuple[List[pathlib.Path], List[bool]]:
+    '''
+        expand the dirs and drop the duplicated files, return the files in order
+        and whether to write each one. the files in a dir are always written
+    '''
+    files: List[pathlib.Path] = []
+    writes: List[bool] = []
+    seen: Dict[pathlib.Path, int] = {}
+
+    def add(file: pathlib.Path, file_write: bool):
+        key = file.resolve()
+        if key in seen:
+            writes[seen[key]] = writes[seen[key]] or file_write
+            return
+        seen[key] = len(files)
+        files.append(file)
+        writes.append(file_write)
+
+    for path in paths:
+        p = pathlib.Path(path)
+        if p.is_file():
+            add(p, bool(write))
+        elif p.is_dir():
+            pattern: str = '**/*.thrift' if recursive else '*.thrift'
+            for file in sorted(p.glob(pattern)):
+                add(file, True)
+        else:
+            raise click.ClickException('path must be file or dir: {}'.format(path))
+    return files, writes
+
+
+def _output_results(files: List[pathlib.Path], results: Iterable[FormatResult], writes: List[bool],
+                    check: Optional[bool], line_range: LineRange = None) -> Tuple[List[pathlib.Path], List[str]]:
+    # results are in the order of files, so stdout is deterministic
+    changed: List[pathlib.Path] = []
+    errors: List[str] = []
+    # iterate the results to the end, so the process pool is shutdown in time
+    for i, (output, is_changed, error) in enumerate(results):
+        file: pathlib.Path = files[i]
+        if isinstance(output, StreamedOutput):
+            try:
+                is_changed = _write_streamed(file, output, writes[i], check)
+            except Exception as e:
+                _, _, error = _format_error(e)
+        if error is not None:
+            errors.append('{}: {}'.format(file, error))
+            continue
+
+        if is_changed:
+            changed.append(file)
+
+        if check:
+            if is_changed:
+                click.echo('would reformat {}'.format(file))
+        elif isinstance(output, StreamedOutput):
+            pass
+        elif writes[i]:
+            # skip the unchanged file, keep its mtime
+            if is_changed:
+                with io.open(file, 'w', encoding='utf8') as f:
+                    f.write(output)
+        elif line_range:
+            # the text out of the range is kept, with the newline at the end
+            sys.stdout.write(output)
         else:
             print(output)
+    return changed, errors
+
+
+def _write_streamed(file: pathlib.Path, output: StreamedOutput, write: bool, check: Optional[bool]) -> bool:
+    '''
+        write a streamed output like `_output_results`, return whether it is changed.
+        a file is formatted to memory and written in place only if changed, the same
+        as the other outputs, so a symlink or a hard link is written through
+    '''
+    if check:
+        return output.write(None)
+    if not write:
+        changed: bool = output.write(sys.stdout)
+        sys.stdout.write('\n')
+        return changed
+
+    buffer = io.StringIO()
+    changed = output.write(buffer)
+    if changed:
+        with io.open(file, 'w', encoding='utf8') as f:
+            f.write(buffer.getvalue())
+    return changed
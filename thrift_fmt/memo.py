@@ -0,0 +1,83 @@
+'''
+remember the output of the top level definitions in this process, so a
+definition formatted before under the same option is not formatted again,
+by any formatter using the memo.
+'''
+from __future__ import annotations
+import collections
+import hashlib
+from typing import Hashable, Iterator, Optional, Tuple, TYPE_CHECKING
+
+from .incremental import Chunk, chunk_spans, format_chunk
+from .option import Option
+
+if TYPE_CHECKING:
+    from .core import ThriftFormatter
+
+
+MAX_DEFINITIONS: int = 4096
+
+# (digest of the chunk text, the chunk is the first of the document, the option values)
+MemoKey = Tuple[bytes, bool, Tuple[Tuple[str, Hashable], ...]]
+
+
+class DefinitionMemo:
+    '''
+        a bounded lru of the formatted chunks. a chunk is a top level definition
+        with its leading and tail comments, its text has all the tokens and
+        comments the output depends on, so the text and the option are the key.
+    '''
+
+    def __init__(self, max_entries: int = MAX_DEFINITIONS):
+        self._max_entries: int = max_entries
+        self._chunks: collections.OrderedDict[MemoKey, Chunk] = collections.OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def key(text: str, is_first: bool, option: Option) -> MemoKey:
+        # a multi line comment at the very start of a document is formatted differently
+        digest: bytes = hashlib.blake2b(text.encode('utf8'), digest_size=16).digest()
+        return digest, is_first, tuple(sorted(vars(option).items()))
+
+    def get(self, key: MemoKey) -> Optional[Chunk]:
+        chunk: Optional[Chunk] = self._chunks.get(key)
+        if chunk is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._chunks.move_to_end(key)
+        return chunk
+
+    def add(self, key: MemoKey, chunk: Chunk):
+        self._chunks[key] = chunk
+        self._chunks.move_to_end(key)
+        while len(self._chunks) > self._max_entries:
+            self._chunks.popitem(last=False)
+
+    def clear(self):
+        self._chunks.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+
+def iter_memo_chunks(fmt: ThriftFormatter, memo: DefinitionMemo) -> Iterator[Chunk]:
+    '''
+        yield the chunks of the document of the formatter, the ones in the memo
+        are not patched nor formatted
+    '''
+    for span in chunk_spans(fmt):
+        start, end, _, first_index = span
+        key: MemoKey = memo.key(fmt._source[start:end], first_index == -1, fmt._option)
+        chunk: Optional[Chunk] = memo.get(key)
+        if chunk is None:
+            chunk = format_chunk(fmt, span)
+            memo.add(key, chunk)
+        yield chunk
+
+
+# shared by the formatters in this process
+shared_memo: DefinitionMemo = DefinitionMemo()
@@ -0,0 +1,35 @@
+from __future__ import annotations
+from typing import Optional
+
+
+class Option:
+    DEFAULT_INDENT: int = 4
+
+    def __init__(self, patch_sep: bool = True, patch_required: bool = True,
+                 keep_comment: bool = True, indent: Optional[int] = None,
+                 align_assign: bool = True, align_field: bool = False):
+
+        self.patch_sep: bool = patch_sep
+        self.patch_required: bool = patch_required
+
+        self.keep_comment: bool = keep_comment
+        self.indent: int = self.DEFAULT_INDENT
+        if indent and indent > 0:
+            self.indent = indent
+
+        self.align_assign: bool = align_assign
+        self.align_field: bool = align_field
+
+    def disble_patch(self) -> Option:
+        self.patch_required = False
+        self.patch_sep = False
+        return self
+
+    def disble_align(self) -> Option:
+        self.align_field = False
+        self.align_assign = False
+        return self
+
+    @property
+    def is_align(self):
+        return self.align_field or self.align_assign
@@ -0,0 +1,105 @@
+'''
+format a large document in worker processes, the document is split at the top
+level definitions by the scanner, each group of them is parsed and formatted by
+a worker, then the outputs are joined in order like the serial formatter.
+'''
+from __future__ import annotations
+import os
+from typing import Iterator, List, Optional, Tuple
+
+from thrift_parser import ThriftData
+
+from .core import ThriftFormatter
+from .dfa_cache import warmup
+from .incremental import Chunk, split_chunks, iter_join_chunks
+from .option import Option
+from .parser import parse, ThriftSyntaxError
+from .scanner import Definition, HEADER_KEYWORDS, definition_bounds, scan_definitions
+
+
+MIN_GROUP_SIZE: int = 16 * 1024  # the smallest text worth a worker
+
+
+def _is_boundary(source: str, pos: int) -> bool:
+    # the text before pos ends a line, or nothing but spaces follows pos in
+    # its line, so no tail comment or token is split apart
+    if pos == 0 or source[pos - 1] == '\n':
+        return True
+    line_end: int = source.find('\n', pos)
+    return not source[pos:line_end if line_end >= 0 else len(source)].strip()
+
+
+def split_groups(source: str, bounds: List[int], count: int, min_size: int) -> List[Tuple[int, int]]:
+    '''
+        split the source at some of the chunk bounds to at most count groups
+        of about the same size, return the (start, end) of each group
+    '''
+    size: int = max(len(source) // max(count, 1), min_size)
+    groups: List[Tuple[int, int]] = []
+    start: int = 0
+    for bound in bounds:
+        if bound - start >= size and len(source) - bound >= min_size and _is_boundary(source, bound):
+            groups.append((start, bound))
+            start = bound
+    groups.append((start, len(source)))
+    return groups
+
+
+def _format_group(args: Tuple[str, Option, bool]) -> List[Chunk]:
+    text, option, is_last = args
+    chunks: List[Chunk] = split_chunks(parse(text, strict=True), option)
+    if not is_last:
+        # the EOF of the group is not in the document
+        assert not chunks[-1].text
+        chunks.pop()
+    return chunks
+
+
+def _format_serial(source: str, option: Option, data: Optional[ThriftData]) -> Iterator[str]:
+    fmt = ThriftFormatter(data or parse(source))
+    fmt.option(option)
+    return fmt.iter_format()
+
+
+def format_parallel(source: str, option: Option, jobs: Optional[int] = None,
+                    data: Optional[ThriftData] = None) -> str:
+    '''
+        the same output as `ThriftFormatter.format`, the source is split by the
+        scanner without parsing, the groups of the top level definitions are
+        parsed and formatted by `jobs` processes. the parsed data of the source
+        is reused if the document is formatted serially.
+    '''
+    return ''.join(iter_format_parallel(source, option, jobs, data))
+
+
+def iter_format_parallel(source: str, option: Option, jobs: Optional[int] = None,
+                         data: Optional[ThriftData] = None) -> Iterator[str]:
+    '''
+        like format_parallel, yield the output by the top level definitions like
+        `ThriftFormatter.iter_format`, once all the groups are formatted.
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    definitions: List[Definition] = scan_definitions(source)
+    # a header after a definition is a syntax error the groups cannot see
+    kinds: List[bool] = [definition.kind in HEADER_KEYWORDS for definition in definitions]
+    if jobs <= 1 or kinds != sorted(kinds, reverse=True):
+        yield from _format_serial(source, option, data)
+        return
+
+    bounds: List[int] = definition_bounds(source, definitions)
+    groups: List[Tuple[int, int]] = split_groups(source, bounds, jobs, MIN_GROUP_SIZE)
+    if len(groups) <= 1:
+        yield from _format_serial(source, option, data)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [(source[start:end], option, i == len(groups) - 1) for i, (start, end) in enumerate(groups)]
+    try:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(groups)), initializer=warmup) as executor:
+            chunks: List[Chunk] = [chunk for group in executor.map(_format_group, tasks) for chunk in group]
+    except ThriftSyntaxError:
+        # a document with errors, let the serial formatter recover it
+        yield from _format_serial(source, option, data)
+        return
+    yield from iter_join_chunks(chunks)
@@ -0,0 +1,113 @@
+'''
+parse thrift to the `thrift_parser.ThriftData` accepted by `ThriftFormatter`,
+with the control of the syntax errors the thrift_parser package does not expose.
+'''
+from __future__ import annotations
+from typing import List, Optional
+
+from antlr4 import InputStream, CommonTokenStream, ParserRuleContext
+from antlr4.Recognizer import Recognizer
+from antlr4.Token import CommonToken
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+
+from thrift_parser import ThriftData
+from thrift_parser.ThriftLexer import ThriftLexer
+from thrift_parser.ThriftParser import ThriftParser
+
+from .lexer import tokenize
+
+
+class ThriftSyntaxError(ValueError):
+
+    def __init__(self, errors: List[str]):
+        super().__init__('; '.join(errors))
+        self.errors: List[str] = errors
+
+
+class _ErrorCollector(ErrorListener):
+
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        self.errors.append('line {}:{} {}'.format(line, column, msg))
+
+
+def _new_data(tokens: CommonTokenStream, document: ThriftParser.DocumentContext) -> ThriftData:
+    # the same shape as ThriftData, without parsing again in its __init__
+    data: ThriftData = ThriftData.__new__(ThriftData)
+    data.tokens = tokens.tokens
+    data.document = document
+    return data
+
+
+def _parse_sll(parser: ThriftParser) -> Optional[ThriftParser.DocumentContext]:
+    '''
+        parse with the SLL prediction and bail out at the first error, which is
+        enough for almost every document. return None if it fails
+    '''
+    listeners = parser._listeners
+    parser.removeErrorListeners()
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    try:
+        parser.enterRule(ParserRuleContext(), 0, 0)
+        return parser.document()
+    except (ParseCancellationException, AttributeError):
+        return None
+    finally:
+        parser._listeners = listeners
+        parser._interp.predictionMode = PredictionMode.LL
+        parser._errHandler = DefaultErrorStrategy()
+
+
+def parse(source: str, strict: bool = False, sll: bool = True, regex_lexer: bool = True) -> ThriftData:
+    '''
+        parse the source like `ThriftData.from_str`. if strict, the errors are
+        not printed, ThriftSyntaxError is raised for any lexer or parser error.
+        the fast SLL prediction is tried first if sll, the full LL prediction
+        (the only one of `ThriftData.from_str`) parses again only if it fails.
+        the tokens are made by `thrift_fmt.lexer` if regex_lexer, the antlr
+        lexer is used only for a source it can not lex.
+    '''
+    collector = _ErrorCollector()
+
+    tokens: Optional[List[CommonToken]] = tokenize(source) if regex_lexer else None
+    recognizers: List[Recognizer] = []
+    if tokens is not None:
+        stream = CommonTokenStream(tokens[-1].getTokenSource())
+    else:
+        lexer = ThriftLexer(InputStream(source))
+        stream = CommonTokenStream(lexer)
+        recognizers.append(lexer)
+    parser = ThriftParser(stream)
+    recognizers.append(parser)
+    if strict:
+        for recognizer in recognizers:
+            recognizer.removeErrorListeners()
+            recognizer.addErrorListener(collector)
+
+    if sll:
+        document: Optional[ThriftParser.DocumentContext] = _parse_sll(parser)
+        if document is not None and not collector.errors:
+            return _new_data(stream, document)
+        # the tokens are kept by the stream, the lexer errors are not reported again
+        stream.seek(0)
+        parser.reset()
+
+    # the same as thrift_parser.parse
+    parser.enterRule(ParserRuleContext(), 0, 0)
+    try:
+        document = parser.document()
+    except AttributeError as e:
+        # the error recovery fails with the root context of thrift_parser
+        if not strict:
+            raise
+        raise ThriftSyntaxError(collector.errors or [str(e)])
+
+    if collector.errors:
+        raise ThriftSyntaxError(collector.errors)
+    return _new_data(stream, document)
@@ -0,0 +1,95 @@
+'''
+find the top level definitions of a thrift document without the antlr parser,
+only the braces, strings and comments are tracked, so a large document can be
+split cheaply. the bounds are the same as `ThriftFormatter._definition_segments`
+for a document without syntax errors.
+'''
+from __future__ import annotations
+import re
+from typing import List, NamedTuple, Optional
+
+
+HEADER_KEYWORDS = frozenset(['include', 'cpp_include', 'namespace', 'cpp_namespace', 'php_namespace'])
+DEFINITION_KEYWORDS = HEADER_KEYWORDS | frozenset([
+    'const', 'typedef', 'enum', 'senum', 'struct', 'union', 'exception', 'service',
+])
+
+_TOKEN = re.compile(r'''
+    (?P<ws>\s+)
+    | (?P<comment>//[^\n]*\n?|\#[^\n]*\n?|/\*.*?\*/)
+    | (?P<literal>"(?:\\.|[^\\"])*"|'(?:\\.|[^\\'])*')
+    | (?P<word>[A-Za-z_][A-Za-z0-9._]*)
+    | (?P<open>[{\[(])
+    | (?P<close>[}\])])
+    | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+class Definition(NamedTuple):
+    # the keyword, as `struct`
+    kind: str
+    # the offset of the keyword
+    start: int
+    # the offset after the definition and its tail comment in the same line
+    end: int
+
+
+def _tail_end(source: str, stop: int, stop_text: str) -> int:
+    # the tail comment is the comment after the definition and the white spaces in
+    # its last line, with the comments next to it in the line
+    if '\n' in stop_text:
+        return stop
+    pos: int = stop
+    while True:
+        match = _TOKEN.match(source, pos)
+        if not match:
+            return stop
+        if match.lastgroup == 'comment':
+            stop = match.end()
+            if '\n' in match.group():
+                return stop
+        elif match.lastgroup != 'ws' or '\n' in match.group():
+            return stop
+        pos = match.end()
+
+
+def scan_definitions(source: str) -> List[Definition]:
+    '''
+        return the top level definitions of the source in order
+    '''
+    definitions: List[Definition] = []
+    kind: str = ''
+    start: int = 0
+    stop: int = 0  # the offset after the last token of the definition
+    stop_text: str = ''
+    depth: int = 0
+    for match in _TOKEN.finditer(source):
+        group = match.lastgroup
+        if group == 'ws' or group == 'comment':
+            continue
+
+        text: str = match.group()
+        if group == 'word' and depth == 0 and text in DEFINITION_KEYWORDS:
+            if kind:
+                definitions.append(Definition(kind, start, _tail_end(source, stop, stop_text)))
+            kind, start = text, match.start()
+        elif group == 'open':
+            depth += 1
+        elif group == 'close':
+            depth = max(depth - 1, 0)
+        stop, stop_text = match.end(), text
+
+    if kind:
+        definitions.append(Definition(kind, start, _tail_end(source, stop, stop_text)))
+    return definitions
+
+
+def definition_bounds(source: str, definitions: Optional[List[Definition]] = None) -> List[int]:
+    '''
+        the offsets between the chunks of `thrift_fmt.incremental`, a deprecated
+        senum outputs nothing, so it is kept with the next definition.
+        the definitions scanned from the source may be given.
+    '''
+    if definitions is None:
+        definitions = scan_definitions(source)
+    return [definition.end for definition in definitions if definition.kind != 'senum']